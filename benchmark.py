@@ -0,0 +1,208 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from catalog import close_catalogs, get_publishers, get_topics
+from compactcatalog import clear_compact_catalogs, get_compact_catalog
+from fuzzy import get_matcher
+from listingcache import get_listing_cache
+from menuName import find_matches
+from menuNum import display_chapters, filter_topics_by_tags
+from ranksearch import clear_ranked_indexes
+from search import ranked_search, search_topics
+from tagindex import clear_tag_indexes
+from topicindex import clear_topic_indexes
+
+'''
+----------------------------
+Benchmarks on a synthetic library
+-----------------------------
+
+Generates a myBooks-like tree (publishers with the '__', '$_' and '#_'
+prefixes, topics, chapters, empty files and some tag.txt files) and times
+the hot paths of the menus against it:
+
+    python benchmark.py --library /tmp/bench/myBooks --generate --topics 2000
+    python benchmark.py --library /tmp/bench/myBooks --output bench_output.txt
+
+"cold" runs start from an empty catalog and empty in-memory indexes, "warm"
+runs reuse them.  The operating system's page cache is not dropped.  Every
+measurement is printed as one JSON object per line.
+'''
+
+PREFIXES = ('__', '$_', '#_')
+WORDS = ('physics', 'chemistry', 'algebra', 'geometry', 'biology', 'history',
+         'grammar', 'calculus', 'statistics', 'economics', 'literature', 'geography',
+         'mechanics', 'optics', 'genetics', 'ecology', 'poetry', 'logic')
+TAGS = ('exam', 'draft', 'reference', 'solutions', '2023', '2024', 'review')
+# Written into every generated library; --generate only deletes a tree that has it.
+GENERATED_MARKER = '.benchmark-library'
+
+
+def generate_library(library, publishers, topics, chapters, files, tag_density, seed=0):
+    """
+    Create a synthetic library under library.
+
+    Args:
+        library (str): Directory to create; it must not exist yet.
+        publishers (int): Number of publishers.
+        topics (int): Topics per publisher.
+        chapters (int): Chapters per topic.
+        files (int): Files per chapter.
+        tag_density (float): Fraction of topics that get a tag.txt.
+        seed (int): Random seed, so runs are comparable.
+
+    Returns:
+        int: Number of directories and files created.
+    """
+    rng = random.Random(seed)
+    os.makedirs(library)
+    open(os.path.join(library, GENERATED_MARKER), 'w').close()
+    created = 0
+    for p in range(publishers):
+        publisher_path = os.path.join(library, f"{PREFIXES[p % len(PREFIXES)]}Publisher {p:04d}")
+        os.mkdir(publisher_path)
+        created += 1
+        for t in range(topics):
+            name = ' '.join(rng.sample(WORDS, 2)).title()
+            topic_path = os.path.join(publisher_path, f"{name} {t:05d}")
+            os.mkdir(topic_path)
+            created += 1
+            if rng.random() < tag_density:
+                with open(os.path.join(topic_path, 'tag.txt'), 'w') as file:
+                    file.write(', '.join(rng.sample(TAGS, rng.randint(1, 3))))
+                created += 1
+            for c in range(chapters):
+                chapter_path = os.path.join(topic_path, f"Chapter {c:03d}")
+                os.mkdir(chapter_path)
+                created += 1
+                for f in range(files):
+                    open(os.path.join(chapter_path, f"file {f:03d}.pdf"), 'w').close()
+                created += files
+    return created
+
+
+def reset_caches(work_dir):
+    """Drop every cache the viewer keeps, in memory and on disk."""
+    close_catalogs()
+    clear_tag_indexes()
+    clear_topic_indexes()
+    clear_compact_catalogs()
+    clear_ranked_indexes()
+    get_listing_cache().clear()
+    get_matcher.cache_clear()
+    for name in os.listdir(work_dir):
+        os.remove(os.path.join(work_dir, name))
+
+
+def timed(function, *args):
+    """Run function(*args) with its printing silenced and return the elapsed seconds."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        function(*args)
+        return time.perf_counter() - start
+
+
+def map_snapshot(root_dir):
+    """Open the compact catalog the way a new process would, from the saved snapshot."""
+    clear_compact_catalogs()
+    return get_compact_catalog(root_dir, refresh=False)
+
+
+def benchmarks(root_dir):
+    """Get the (name, function, args) operations to time against root_dir."""
+    publishers = get_publishers(root_dir)
+    publisher_path = os.path.join(root_dir, publishers[0])
+    topics = get_topics(publisher_path)
+    topic_path = os.path.join(publisher_path, topics[len(topics) // 2])
+    typo = topics[len(topics) // 3][:-2].lower()
+    return [
+        ('get_publishers', get_publishers, (root_dir,)),
+        ('display_chapters', display_chapters, (topic_path,)),
+        ('search_topics', search_topics, (root_dir, WORDS[3][:5])),
+        ('ranked_search', ranked_search, (root_dir, WORDS[3][:2])),
+        ('find_matches', find_matches, (typo, topics)),
+        ('filter_topics_by_tags', filter_topics_by_tags, (root_dir, [TAGS[0]])),
+        ('get_compact_catalog', get_compact_catalog, (root_dir,)),
+        ('map_snapshot', map_snapshot, (root_dir,)),
+    ]
+
+
+def run(root_dir, repeat, work_dir):
+    """Time every benchmark cold and warm and yield one result record per measurement."""
+    reset_caches(work_dir)
+    operations = benchmarks(root_dir)
+    for name, function, args in operations:
+        cold = []
+        for _ in range(repeat):
+            reset_caches(work_dir)
+            cold.append(timed(function, *args))
+        warm = [timed(function, *args) for _ in range(repeat)]
+        for cache, samples in (('cold', cold), ('warm', warm)):
+            yield {
+                'benchmark': name,
+                'cache': cache,
+                'repeat': repeat,
+                'min_seconds': min(samples),
+                'median_seconds': statistics.median(samples),
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the viewer on a synthetic library.")
+    parser.add_argument('--library', required=True, help="library root to benchmark (or create)")
+    parser.add_argument('--generate', action='store_true',
+                        help="create the library first (replacing only one made by --generate)")
+    parser.add_argument('--publishers', type=int, default=12)
+    parser.add_argument('--topics', type=int, default=200, help="topics per publisher")
+    parser.add_argument('--chapters', type=int, default=10, help="chapters per topic")
+    parser.add_argument('--files', type=int, default=5, help="files per chapter")
+    parser.add_argument('--tag-density', type=float, default=0.2,
+                        help="fraction of topics with a tag.txt")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="also append the JSON lines to this file")
+    args = parser.parse_args(argv)
+
+    library = os.path.abspath(args.library)
+    if args.generate:
+        if os.path.exists(library):
+            if not os.path.isfile(os.path.join(library, GENERATED_MARKER)):
+                print(f"Error: '{library}' exists and was not created by --generate; "
+                      "remove it yourself or pick another path.", file=sys.stderr)
+                return 1
+            shutil.rmtree(library)
+        start = time.perf_counter()
+        created = generate_library(library, args.publishers, args.topics, args.chapters,
+                                   args.files, args.tag_density, args.seed)
+        print(json.dumps({'generated': library, 'entries': created,
+                          'seconds': time.perf_counter() - start}))
+
+    # The catalog and topic index files live in the current directory.
+    work_dir = tempfile.mkdtemp(prefix='viewer-bench-')
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        results = list(run(library, args.repeat, work_dir))
+    finally:
+        close_catalogs()
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    lines = [json.dumps(result) for result in results]
+    print('\n'.join(lines))
+    if args.output:
+        with open(args.output, 'a') as file:
+            file.write('\n'.join(lines) + '\n')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog import LISTING_WORKERS, TAG_FILE, get_topics, parse_tags
+from tagindex import tags_saved
+
+'''
+----------------------------
+Bulk tag editing
+-----------------------------
+
+Adds and removes tags on many directories at once.  Every 'tag.txt' is
+read and rewritten on a thread pool; each write goes to a temporary file in
+the same directory that is then renamed over the old one, so a crash or a
+concurrent reader never sees a half-written tag file.  Once all files are
+written, the catalog entries of the changed directories are refreshed in a
+single transaction and the loaded tag indexes are patched for those
+directories only.  A directory that cannot be edited (deleted since it was
+listed, or on a read-only share) is reported back instead of stopping the
+other edits.
+'''
+
+
+def read_tags(directory):
+    """Get the tags in the 'tag.txt' of a directory, [] if it has none."""
+    try:
+        with open(os.path.join(directory, TAG_FILE), 'r') as file:
+            return parse_tags(file.read())
+    except FileNotFoundError:
+        return []
+
+
+def write_tags(directory, tags):
+    """Atomically replace the 'tag.txt' of a directory with tags."""
+    temp_file = os.path.join(directory, f".{TAG_FILE}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(temp_file, 'w') as file:
+            file.write(', '.join(tags))
+        os.replace(temp_file, os.path.join(directory, TAG_FILE))
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
+def _retag_one(directory, add, remove):
+    """Apply one edit; return (whether the tag file changed, OSError or None)."""
+    try:
+        current = read_tags(directory)
+        tags = [tag for tag in current if tag not in remove]
+        tags += [tag for tag in add if tag not in tags]
+        if tags == current:
+            return False, None
+        write_tags(directory, tags)
+    except OSError as e:
+        return False, e
+    return True, None
+
+
+def retag(directories, add=(), remove=(), workers=LISTING_WORKERS):
+    """
+    Add and remove tags on several directories.
+
+    A directory without a 'tag.txt' only gets one when a tag is added to it,
+    and files whose tags would not change are left untouched.
+
+    Args:
+        directories (list): Directories whose 'tag.txt' to edit.
+        add (iterable): Tags to add, appended in this order.
+        remove (iterable): Tags to remove; a tag in both add and remove is added.
+        workers (int): Maximum number of files edited concurrently.
+
+    Returns:
+        tuple: (directories whose tag file was written, list of
+        (directory, OSError) for those that could not be edited).
+    """
+    add = list(dict.fromkeys(add))
+    remove = set(remove) - set(add)
+    directories = [os.path.abspath(directory) for directory in directories]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(lambda directory: _retag_one(directory, add, remove), directories))
+    changed = [directory for directory, (written, _) in zip(directories, results) if written]
+    failed = [(directory, error) for directory, (_, error) in zip(directories, results) if error]
+    if changed:
+        tags_saved(*changed)
+    return changed, failed
+
+
+def publisher_topic_dirs(publisher_path):
+    """Get the paths of every topic of a publisher, for retagging a whole publisher."""
+    return [os.path.join(publisher_path, topic) for topic in get_topics(publisher_path)]
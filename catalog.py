@@ -0,0 +1,605 @@
+import os
+import sqlite3
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from listing import scan_directory
+from listingcache import get_listing_cache
+from profiling import traced
+
+'''
+----------------------------
+Persistent catalog of the library
+-----------------------------
+
+The catalog records the publisher -> topic -> chapter hierarchy, the file
+count of every listed directory and the tags found in its 'tag.txt' in a
+SQLite file next to address.csv.  A directory is only listed again when its
+mtime or inode no longer matches the one stored with it, so browsing an
+unchanged library costs a single stat per screen instead of a full listing.
+'''
+
+CATALOG_FILE = 'catalog.db'
+TAG_FILE = 'tag.txt'
+PUBLISHER_PREFIXES = ('$_', '$__', '#_', '#__', '__')
+
+# Concurrent directory listings when counting the files of many chapters.
+LISTING_WORKERS = int(os.environ.get('VIEWER_LISTING_WORKERS', 16))
+
+# Directories remembered by changed_since; a reader further behind starts over.
+CHANGE_LOG_SIZE = 10000
+
+# Bump whenever the table layout changes; older catalogs are rebuilt.
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    name TEXT,
+    mtime INTEGER,
+    inode INTEGER,
+    file_count INTEGER,
+    tags TEXT,
+    tag_mtime INTEGER
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent);
+"""
+
+stat_path = traced('stat', os.stat, 'os.stat')
+open_file = traced('open', open, 'open')
+
+DirRecord = namedtuple('DirRecord', ['mtime', 'inode', 'file_count', 'tags', 'tag_mtime'])
+
+# Entries added, removed and renamed (as (old, new) pairs) below one directory.
+DirChanges = namedtuple('DirChanges', ['added', 'removed', 'renamed'])
+
+
+def parse_tags(line):
+    """Split a comma separated tag line into a list of tags."""
+    return [tag.strip() for tag in line.split(',') if tag.strip()]
+
+
+class Catalog:
+    """SQLite backed cache of directory listings, file counts and tags."""
+
+    def __init__(self, db_path=CATALOG_FILE):
+        self.db_path = db_path
+        self._depth = 0
+        self.generation = 0
+        self._changes = deque(maxlen=CHANGE_LOG_SIZE)   # (generation, directory path)
+        try:
+            self.conn = self._open()
+        except sqlite3.DatabaseError:
+            # Corrupt (e.g. after a crash with synchronous off) or not a
+            # catalog at all: start again from an empty one.
+            self._delete_files()
+            self.conn = self._open()
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            # The catalog is a cache that can always be rebuilt from the disk, so
+            # commits skip the fsync; WAL keeps them cheap while readers continue.
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                conn.execute("DROP TABLE IF EXISTS dirs")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.executescript(SCHEMA)
+            conn.execute("SELECT count(*) FROM dirs WHERE path = ''").fetchone()
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+        return conn
+
+    def _delete_files(self):
+        """Delete the database file together with its WAL and shared-memory files."""
+        for path in (self.db_path, f"{self.db_path}-wal", f"{self.db_path}-shm"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """Close the underlying database connection."""
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group the catalog writes made inside the block into one transaction.
+
+        Blocks can be nested; only the outermost one commits, or rolls back
+        if an exception escapes it.
+        """
+        self._depth += 1
+        try:
+            yield
+        except BaseException:
+            self._depth -= 1
+            if not self._depth:
+                self.conn.rollback()
+            raise
+        self._depth -= 1
+        if not self._depth:
+            self.conn.commit()
+
+    def _record(self, path):
+        row = self.conn.execute(
+            "SELECT mtime, inode, file_count, tags, tag_mtime FROM dirs WHERE path = ?", (path,)
+        ).fetchone()
+        return DirRecord(*row) if row is not None else None
+
+    def _read_tags(self, path):
+        """Read the tag file of a directory, returning (tags, tag file mtime)."""
+        tag_file_path = os.path.join(path, TAG_FILE)
+        try:
+            tag_mtime = stat_path(tag_file_path).st_mtime_ns
+            with open_file(tag_file_path, 'r') as file:
+                return parse_tags(file.read().strip()), tag_mtime
+        except FileNotFoundError:
+            return [], None
+
+    def _tag_changed(self, path, tag_mtime):
+        try:
+            return stat_path(os.path.join(path, TAG_FILE)).st_mtime_ns != tag_mtime
+        except FileNotFoundError:
+            return True
+
+    def _forget_subtree(self, path):
+        """Drop a directory and everything below it from the catalog."""
+        prefix = os.path.join(path, '')
+        self.conn.execute(
+            "DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+            (path, len(prefix), prefix),
+        )
+        get_listing_cache().invalidate(path, subtree=True)
+
+    def _move_subtree(self, old_path, new_path):
+        """Re-key a renamed directory and everything below it, keeping what is cached."""
+        old_prefix = os.path.join(old_path, '')
+        new_prefix = os.path.join(new_path, '')
+        self.conn.execute(
+            "UPDATE dirs SET path = ?, name = ? WHERE path = ?",
+            (new_path, os.path.basename(new_path), old_path),
+        )
+        self.conn.execute(
+            "UPDATE dirs SET path = ? || substr(path, ?), parent = ? || substr(parent, ?) "
+            "WHERE substr(path, 1, ?) = ?",
+            (new_prefix, len(old_prefix) + 1, new_path, len(old_path) + 1,
+             len(old_prefix), old_prefix),
+        )
+        get_listing_cache().invalidate(old_path, subtree=True)
+
+    def _probe(self, path, record):
+        """
+        Filesystem half of update: stat the directory and list it if needed.
+
+        Only touches the disk, never the database, so it can run in worker
+        threads.
+
+        Returns:
+            tuple: (stat, DirListing or None, (tags, tag_mtime) or None).
+        """
+        stat = stat_path(path)
+        if record is None or record.mtime != stat.st_mtime_ns or record.inode != stat.st_ino:
+            listing = scan_directory(path)
+            tags = self._read_tags(path) if TAG_FILE in listing.files else ([], None)
+            return stat, listing, tags
+        if record.tag_mtime is not None and self._tag_changed(path, record.tag_mtime):
+            return stat, None, self._read_tags(path)
+        return stat, None, None
+
+    def _same_directory(self, path, mtime):
+        """
+        Tell whether path is a renamed directory last listed with the given mtime.
+
+        Filesystems hand a freed inode straight to the next new directory, so
+        a matching inode alone does not prove a rename; a renamed directory
+        also keeps its own mtime, while a new one has a fresh mtime.
+        """
+        if mtime is None:
+            return False
+        try:
+            return stat_path(path).st_mtime_ns == mtime
+        except OSError:
+            return False
+
+    def _store_listing(self, path, stat, listing, tags, tag_mtime):
+        """Store a fresh listing of a directory and reconcile its children."""
+        dirs, files = listing
+        added, removed, renamed = [], [], []
+        get_listing_cache().invalidate(path)
+        with self.transaction():
+            self.conn.execute(
+                "INSERT INTO dirs (path, parent, name, mtime, inode, file_count, tags, tag_mtime) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET mtime = excluded.mtime, inode = excluded.inode, "
+                "file_count = excluded.file_count, tags = excluded.tags, "
+                "tag_mtime = excluded.tag_mtime",
+                (path, os.path.dirname(path), os.path.basename(path), stat.st_mtime_ns,
+                 stat.st_ino, len(files), ', '.join(tags), tag_mtime),
+            )
+            known = {name: (inode, mtime) for name, inode, mtime in self.conn.execute(
+                "SELECT name, inode, mtime FROM dirs WHERE parent = ?", (path,))}
+            gone = set(known) - set(dirs)
+            # Inodes that are missing or 0 (some SMB and FAT mounts) cannot
+            # tell a rename from an unrelated removal and addition.
+            gone_by_inode = {known[name][0]: name for name in gone if known[name][0]}
+            for name in sorted(set(dirs) - set(known)):
+                new_path = os.path.join(path, name)
+                inode = dirs[name]
+                old_name = gone_by_inode.pop(inode, None) if inode else None
+                if old_name is not None and not self._same_directory(new_path, known[old_name][1]):
+                    old_name = None
+                if old_name is not None:
+                    gone.discard(old_name)
+                    self._move_subtree(os.path.join(path, old_name), new_path)
+                    renamed.append((os.path.join(path, old_name), new_path))
+                else:
+                    self.conn.execute(
+                        "INSERT INTO dirs (path, parent, name, inode) VALUES (?, ?, ?, ?)",
+                        (new_path, path, name, inode),
+                    )
+                    added.append(new_path)
+            for name in sorted(gone):
+                self._forget_subtree(os.path.join(path, name))
+                removed.append(os.path.join(path, name))
+        return DirChanges(added, removed, renamed)
+
+    def _apply(self, path, record, probe):
+        """Database half of update: store what _probe found."""
+        stat, listing, tags = probe
+        if listing is not None or tags is not None:
+            self.generation += 1
+            self._changes.append((self.generation, path))
+        if listing is not None:
+            changes = self._store_listing(path, stat, listing, *tags)
+            return self._record(path), changes
+        if tags is not None:
+            with self.transaction():
+                self.conn.execute(
+                    "UPDATE dirs SET tags = ?, tag_mtime = ? WHERE path = ?",
+                    (', '.join(tags[0]), tags[1], path),
+                )
+            return self._record(path), None
+        return record, None
+
+    def update(self, path):
+        """
+        Make sure the catalog entry of a directory is up to date.
+
+        The directory is stat'ed once; it is only listed again when its mtime
+        or inode differs from the stored one.  A directory holding a
+        'tag.txt' also has the tag file stat'ed, since editing it in place
+        does not touch the directory mtime.
+
+        Args:
+            path (str): Directory to validate.
+
+        Returns:
+            tuple: The DirRecord of the directory and the DirChanges found
+            below it, or None when its listing was still current.
+        """
+        path = os.path.abspath(path)
+        record = self._record(path)
+        return self._apply(path, record, self._probe(path, record))
+
+    def changed_since(self, generation):
+        """
+        Get the directories whose listing or tags were stored after generation.
+
+        Whichever caller validates a directory consumes the change, so
+        indexes kept beside the catalog catch up from here instead of from
+        the DirChanges of their own rescans.
+
+        Args:
+            generation (int): self.generation when the caller last looked.
+
+        Returns:
+            tuple: (paths, self.generation); paths is None when the log no
+            longer reaches back to generation and the caller must start over.
+        """
+        if generation == self.generation:
+            return [], generation
+        if generation > self.generation or not self._changes or self._changes[0][0] > generation + 1:
+            return None, self.generation
+        return [path for changed, path in self._changes if changed > generation], self.generation
+
+    def split_update(self, path):
+        """
+        Split update(path) for callers that schedule the disk access themselves.
+
+        Returns:
+            tuple: (probe, store). probe() stats and lists the directory and
+            can run on any thread; store(probe()) saves the result on the
+            thread owning the database and returns the DirRecord.
+        """
+        path = os.path.abspath(path)
+        record = self._record(path)
+        return (lambda: self._probe(path, record)), (lambda probe: self._apply(path, record, probe)[0])
+
+    def split_rescan(self, root_dir, depth=None):
+        """
+        Split scanner.rescan(root_dir) like split_update, for a whole tree.
+
+        The records of every catalogued directory below root_dir are read up
+        front, so the walk needs no database access.
+
+        Args:
+            root_dir (str): Directory to rescan.
+            depth (int): How many levels below root_dir to go, all by default
+                (1 validates the root and its publishers).
+
+        Returns:
+            tuple: (probe, store). probe() stats every directory and lists the
+            new and changed ones (raising FileNotFoundError if root_dir is
+            gone), and can run on any thread; store(probe())
+            saves the results in one transaction on the thread owning the
+            database and returns the DirChanges below root_dir.
+        """
+        root_dir = os.path.abspath(root_dir)
+        prefix = os.path.join(root_dir, '')
+        records, children = {}, {}
+        for path, parent, name, *record in self.conn.execute(
+                "SELECT path, parent, name, mtime, inode, file_count, tags, tag_mtime FROM dirs "
+                "WHERE path = ? OR substr(path, 1, ?) = ?", (root_dir, len(prefix), prefix)):
+            records[path] = DirRecord(*record)
+            children.setdefault(parent, []).append(name)
+
+        def probe():
+            found = []
+            pending = [(root_dir, 0)]
+            while pending:
+                path, level = pending.pop()
+                try:
+                    result = self._probe(path, records.get(path))
+                except (FileNotFoundError, NotADirectoryError):
+                    if path == root_dir:
+                        raise
+                    # Vanished since its parent was listed; the next scan of the parent drops it.
+                    continue
+                found.append((path, result))
+                if depth is not None and level >= depth:
+                    continue
+                listing = result[1]
+                names = listing.dirs if listing is not None else children.get(path, ())
+                pending.extend((os.path.join(path, name), level + 1) for name in names)
+            return found
+
+        def store(found):
+            added, removed, renamed = [], [], []
+            with self.transaction():
+                for path, result in found:
+                    _, changes = self._apply(path, records.get(path), result)
+                    if changes is not None:
+                        added.extend(changes.added)
+                        removed.extend(changes.removed)
+                        renamed.extend(changes.renamed)
+            return DirChanges(sorted(added), sorted(removed), sorted(renamed))
+        return probe, store
+
+    def refresh_iter(self, paths, workers=LISTING_WORKERS):
+        """
+        Validate several directories, yielding each one as soon as it is done.
+
+        The stats and listings run concurrently; each result is stored on the
+        calling thread, which owns the database connection, before it is
+        yielded.
+
+        Args:
+            paths (list): Directories to validate.
+            workers (int): Maximum number of concurrent listings.
+
+        Yields:
+            tuple: (path, DirRecord), in completion order.
+        """
+        paths = [os.path.abspath(path) for path in paths]
+        records = {path: self._record(path) for path in paths}
+        if workers <= 1 or len(paths) <= 1:
+            for path in paths:
+                yield path, self._apply(path, records[path], self._probe(path, records[path]))[0]
+            return
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(self._probe, path, records[path]): path for path in paths}
+            try:
+                for future in as_completed(futures):
+                    path = futures[future]
+                    yield path, self._apply(path, records[path], future.result())[0]
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def refresh_many(self, paths, workers=LISTING_WORKERS):
+        """
+        Validate several directories, spreading the disk access over a thread pool.
+
+        Returns:
+            list: The DirRecord of each directory, in the order of paths.
+        """
+        paths = [os.path.abspath(path) for path in paths]
+        with self.transaction():
+            records = dict(self.refresh_iter(paths, workers))
+        return [records[path] for path in paths]
+
+    def refresh(self, path):
+        """Validate a directory and return its DirRecord."""
+        return self.update(path)[0]
+
+    def record(self, path):
+        """Get the stored DirRecord of a directory, or None, without touching the disk."""
+        return self._record(os.path.abspath(path))
+
+    def children(self, path):
+        """Get the sorted sub-directory names stored for a directory, without touching the disk."""
+        return sorted(name for (name,) in self.conn.execute(
+            "SELECT name FROM dirs WHERE parent = ?", (os.path.abspath(path),)))
+
+    def subdirs(self, path):
+        """Get the sorted sub-directory names of a directory."""
+        self.refresh(path)
+        return self.children(path)
+
+    def file_count(self, path):
+        """Get the number of files directly inside a directory."""
+        return self.refresh(path).file_count
+
+    def tags(self, path):
+        """Get the tags stored in the 'tag.txt' of a directory."""
+        return parse_tags(self.refresh(path).tags or '')
+
+    def tagged_dirs(self, path):
+        """
+        Get every catalogued directory at or below path that has a 'tag.txt'.
+
+        Only the catalog is consulted; run scanner.rescan first to pick up
+        changes on disk.
+
+        Returns:
+            list: Sorted (directory path, tags) pairs.
+        """
+        path = os.path.abspath(path)
+        prefix = os.path.join(path, '')
+        rows = self.conn.execute(
+            "SELECT path, tags FROM dirs WHERE tag_mtime IS NOT NULL "
+            "AND (path = ? OR substr(path, 1, ?) = ?)",
+            (path, len(prefix), prefix),
+        )
+        return sorted((tagged_path, parse_tags(tags)) for tagged_path, tags in rows)
+
+    def descendants(self, path):
+        """
+        Get every catalogued directory below path, without touching the disk.
+
+        Returns:
+            iterator: (parent path, name, file count or None) rows, in no
+            particular order, read lazily from the database.
+        """
+        prefix = os.path.join(os.path.abspath(path), '')
+        return self.conn.execute(
+            "SELECT parent, name, file_count FROM dirs WHERE substr(path, 1, ?) = ?",
+            (len(prefix), prefix),
+        )
+
+    def signature(self, path):
+        """Get a value that changes whenever a directory at or below path is listed again."""
+        path = os.path.abspath(path)
+        prefix = os.path.join(path, '')
+        return self.conn.execute(
+            "SELECT count(*), total(mtime), total(file_count) FROM dirs "
+            "WHERE path = ? OR substr(path, 1, ?) = ?",
+            (path, len(prefix), prefix),
+        ).fetchone()
+
+    def listed_dirs(self, path):
+        """Get every directory at or below path whose listing is stored in the catalog."""
+        path = os.path.abspath(path)
+        prefix = os.path.join(path, '')
+        rows = self.conn.execute(
+            "SELECT path FROM dirs WHERE mtime IS NOT NULL "
+            "AND (path = ? OR substr(path, 1, ?) = ?)",
+            (path, len(prefix), prefix),
+        )
+        return sorted(listed_path for (listed_path,) in rows)
+
+
+_catalogs = {}
+_sync_hooks = []
+
+
+def add_sync_hook(hook):
+    """
+    Register hook(catalog) to run whenever the shared catalog is fetched.
+
+    get_catalog is called on the main thread before every read, which makes
+    it the place where work queued by background threads (e.g. watcher
+    events) is applied to the database.
+    """
+    _sync_hooks.append(hook)
+
+
+def remove_sync_hook(hook):
+    """Unregister a hook added with add_sync_hook."""
+    if hook in _sync_hooks:
+        _sync_hooks.remove(hook)
+
+
+def get_catalog(db_path=CATALOG_FILE):
+    """Get the shared catalog stored at db_path, opening it on first use."""
+    db_path = os.path.abspath(db_path)
+    if db_path not in _catalogs:
+        _catalogs[db_path] = Catalog(db_path)
+    for hook in list(_sync_hooks):
+        hook(_catalogs[db_path])
+    return _catalogs[db_path]
+
+
+def close_catalogs():
+    """Close every open catalog so the next get_catalog starts from the database file."""
+    for catalog in _catalogs.values():
+        catalog.close()
+    _catalogs.clear()
+
+
+def _cached_subdirs(path):
+    """Get the sub-directory names of a directory through the shared listing cache."""
+    path = os.path.abspath(path)
+    catalog = get_catalog()
+    cache = get_listing_cache()
+    names = cache.get('subdirs', path)
+    if names is None:
+        record = catalog.refresh(path)
+        names = catalog.children(path)
+        cache.put('subdirs', path, record.mtime, names)
+        cache.put('file_count', path, record.mtime, record.file_count)
+    return list(names)
+
+
+def get_publishers(root_dir, prefixes=PUBLISHER_PREFIXES):
+    """Get a list of publishers that start with certain prefixes."""
+    return [d for d in _cached_subdirs(root_dir) if d.startswith(tuple(prefixes))]
+
+
+def get_topics(publisher_path):
+    """Get a list of topics under a publisher."""
+    return _cached_subdirs(publisher_path)
+
+
+def get_chapters(topic_path):
+    """Get a list of chapters under a topic."""
+    return _cached_subdirs(topic_path)
+
+
+def count_files(chapter_path):
+    """Count files in a chapter."""
+    return count_files_many([chapter_path], workers=1)[0]
+
+
+def count_files_many(chapter_paths, workers=LISTING_WORKERS):
+    """
+    Count the files of several chapters concurrently, keeping their order.
+
+    A chapter that no longer exists gets None.
+    """
+    paths = [os.path.abspath(path) for path in chapter_paths]
+    catalog = get_catalog()
+    cache = get_listing_cache()
+    counts = {path: cache.get('file_count', path) for path in paths}
+    missing = [path for path in paths if counts[path] is None]
+    if missing:
+        try:
+            records = catalog.refresh_many(missing, workers)
+        except FileNotFoundError:
+            # A chapter from a cached listing was deleted: forget the listing
+            # of its parent so the next get_chapters lists it again.
+            gone = {path for path in missing if not os.path.isdir(path)}
+            for path in gone:
+                cache.invalidate(os.path.dirname(path))
+            missing = [path for path in missing if path not in gone]
+            records = catalog.refresh_many(missing, workers)
+        for path, record in zip(missing, records):
+            counts[path] = record.file_count
+            cache.put('file_count', path, record.mtime, record.file_count)
+    return [counts[path] for path in paths]
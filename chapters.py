@@ -0,0 +1,33 @@
+import os
+
+from catalog import count_files_many, get_chapters
+from pager import page_bounds, print_page_footer
+from profiling import screen
+
+'''
+----------------------------
+Chapter listing shared by the menus
+-----------------------------
+
+Every menu ends in the same chapter list.  Each one profiles it under a
+screen name of its own, so chapters_screen gives the menu its copy.
+'''
+
+
+def display_chapters(topic_path, page=0):
+    """Display one page of the chapters under a selected topic, counting files for that page only."""
+    chapters = get_chapters(topic_path)
+    page, start, stop = page_bounds(len(chapters), page)
+    file_counts = count_files_many([os.path.join(topic_path, chapter) for chapter in chapters[start:stop]])
+    print("\nAvailable Chapters:")
+    for index, file_count in zip(range(start, stop), file_counts):
+        if file_count is None:
+            continue    # Deleted since the chapter list was cached.
+        print(f"{index + 1}. [{file_count} Files] - {chapters[index]}")
+    print_page_footer(page, len(chapters))
+    return chapters
+
+
+def chapters_screen(screen_name):
+    """Get display_chapters profiled as the screen screen_name (see profiling.screen)."""
+    return screen(screen_name)(display_chapters)
@@ -0,0 +1,262 @@
+import os
+from array import array
+from collections import deque
+
+from catalog import PUBLISHER_PREFIXES, get_catalog
+from scanner import rescan
+from snapshot import SNAPSHOT_FILE, read_snapshot, write_snapshot
+
+'''
+----------------------------
+Compact in-memory catalog
+-----------------------------
+
+The whole directory tree of a library held in a handful of flat arrays
+instead of one Python object per path:
+
+    parents      array('i')  id of the parent directory (-1 for the root)
+    name_ids     array('I')  id of the directory name
+    file_counts  array('I')  files directly in the directory
+    first_child  array('I')  id of the first child; the children of node i
+                             are first_child[i] .. first_child[i + 1] - 1
+
+Directories are numbered breadth first with siblings sorted by name, which is
+what makes every child list a contiguous id range.  Names are interned: each
+distinct name ("Chapter 01" appears under thousands of topics) is stored once,
+UTF-8 encoded, in a single bytes buffer addressed by name_offsets.  That is
+16 bytes per directory plus the distinct names.
+
+Node objects are only created on access and are two-slot views over the
+arrays.  Tags are not kept here; see tagindex.py.
+
+Every rebuilt snapshot is also saved to catalog.snapshot, which the next
+process maps instead of reading the catalog database (see snapshot.py).
+'''
+
+# file_counts value of a directory that was never listed.
+UNKNOWN_COUNT = 0xFFFFFFFF
+
+
+class Node:
+    """A view of one directory of a CompactCatalog."""
+
+    __slots__ = ('catalog', 'id')
+
+    def __init__(self, catalog, node_id):
+        self.catalog = catalog
+        self.id = node_id
+
+    @property
+    def name(self):
+        return self.catalog.name(self.id)
+
+    @property
+    def path(self):
+        return self.catalog.path(self.id)
+
+    @property
+    def file_count(self):
+        """Number of files in the directory, or None if it was never listed."""
+        count = self.catalog.file_counts[self.id]
+        return None if count == UNKNOWN_COUNT else count
+
+    @property
+    def parent(self):
+        parent_id = self.catalog.parents[self.id]
+        return None if parent_id < 0 else Node(self.catalog, parent_id)
+
+    @property
+    def children(self):
+        return [Node(self.catalog, child_id) for child_id in self.catalog.child_ids(self.id)]
+
+    def __eq__(self, other):
+        return isinstance(other, Node) and (self.catalog, self.id) == (other.catalog, other.id)
+
+    def __hash__(self):
+        return hash((id(self.catalog), self.id))
+
+    def __repr__(self):
+        return f"Node({self.path!r})"
+
+
+class CompactCatalog:
+    """Read-only snapshot of a library tree in flat arrays."""
+
+    def __init__(self, root_dir, parents, name_ids, file_counts, first_child, name_offsets, names):
+        """
+        Wrap the arrays of a snapshot; use from_rows or from_catalog to build one.
+
+        The arrays can be anything indexable by node id, such as array
+        objects or memoryviews of a mapped snapshot file (see snapshot.py).
+        """
+        self.root_dir = root_dir
+        self.parents = parents
+        self.name_ids = name_ids
+        self.file_counts = file_counts
+        self.first_child = first_child
+        self.name_offsets = name_offsets
+        self.names = names
+
+    @classmethod
+    def from_rows(cls, root_dir, rows, root_count=None):
+        """
+        Build a snapshot from catalog rows.
+
+        Args:
+            root_dir (str): Path of the root directory.
+            rows (iterable): (parent path, name, file count or None) of every
+                directory below root_dir, as Catalog.descendants returns them.
+            root_count (int): Files directly in root_dir, if known.
+        """
+        root_dir = os.path.abspath(root_dir)
+        children = {}
+        for parent, name, file_count in rows:
+            children.setdefault(parent, []).append((name, file_count))
+
+        interned = {}
+        names = bytearray()
+        name_offsets = array('I', [0])
+        parents = array('i')
+        name_ids = array('I')
+        file_counts = array('I')
+        first_child = array('I')
+
+        def add(parent_id, name, file_count):
+            name_id = interned.get(name)
+            if name_id is None:
+                name_id = interned[name] = len(name_offsets) - 1
+                names.extend(name.encode('utf-8', 'surrogateescape'))
+                name_offsets.append(len(names))
+            parents.append(parent_id)
+            name_ids.append(name_id)
+            file_counts.append(UNKNOWN_COUNT if file_count is None else file_count)
+
+        add(-1, root_dir, root_count)
+        pending = deque([root_dir])
+        node_id = 0
+        while pending:
+            path = pending.popleft()
+            first_child.append(len(parents))
+            for name, file_count in sorted(children.pop(path, ())):
+                add(node_id, name, file_count)
+                pending.append(os.path.join(path, name))
+            node_id += 1
+        first_child.append(len(parents))
+        return cls(root_dir, parents, name_ids, file_counts, first_child, name_offsets, bytes(names))
+
+    @classmethod
+    def from_catalog(cls, root_dir, catalog=None):
+        """Snapshot the part of a Catalog below root_dir (run scanner.rescan first)."""
+        catalog = catalog or get_catalog()
+        root_dir = os.path.abspath(root_dir)
+        record = catalog.record(root_dir)
+        return cls.from_rows(root_dir, catalog.descendants(root_dir), record.file_count if record else 0)
+
+    def __len__(self):
+        return len(self.parents)
+
+    def name(self, node_id):
+        """Name of a directory (the full path for the root)."""
+        name_id = self.name_ids[node_id]
+        start, end = self.name_offsets[name_id], self.name_offsets[name_id + 1]
+        return str(self.names[start:end], 'utf-8', 'surrogateescape')
+
+    def path(self, node_id):
+        """Full path of a directory."""
+        parts = []
+        while node_id > 0:
+            parts.append(self.name(node_id))
+            node_id = self.parents[node_id]
+        return os.path.join(self.root_dir, *reversed(parts))
+
+    def child_ids(self, node_id):
+        """Ids of the sub-directories of a directory, sorted by name."""
+        return range(self.first_child[node_id], self.first_child[node_id + 1])
+
+    @property
+    def root(self):
+        return Node(self, 0)
+
+    def find(self, path):
+        """Get the Node of a path below (or at) the root, or None if it is not catalogued."""
+        relative = os.path.relpath(os.path.abspath(path), self.root_dir)
+        if relative == os.curdir:
+            return self.root
+        if relative.startswith(os.pardir):
+            return None
+        node_id = 0
+        for part in relative.split(os.sep):
+            ids = self.child_ids(node_id)
+            # Siblings are sorted by name, so a binary search finds the part.
+            low, high = ids.start, ids.stop
+            while low < high:
+                middle = (low + high) // 2
+                if self.name(middle) < part:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low == ids.stop or self.name(low) != part:
+                return None
+            node_id = low
+        return Node(self, node_id)
+
+    def publishers(self, prefixes=PUBLISHER_PREFIXES):
+        """Get the publisher nodes, like catalog.get_publishers."""
+        return [node for node in self.root.children if node.name.startswith(tuple(prefixes))]
+
+    def nbytes(self):
+        """Memory used by the arrays and the name buffer."""
+        arrays = (self.parents, self.name_ids, self.file_counts, self.first_child, self.name_offsets)
+        return sum(memoryview(part).nbytes for part in arrays) + len(self.names)
+
+    def bytes_per_dir(self):
+        return self.nbytes() / len(self)
+
+
+_compact_catalogs = {}
+
+
+def _load(snapshot_file, root_dir):
+    loaded = read_snapshot(snapshot_file)
+    if loaded is None or loaded[0] != root_dir:
+        return None
+    return loaded[1], CompactCatalog(root_dir, *loaded[2:])
+
+
+def _save(snapshot_file, signature, compact):
+    write_snapshot(snapshot_file, compact.root_dir, signature, compact.parents, compact.name_ids,
+                   compact.file_counts, compact.first_child, compact.name_offsets, compact.names)
+
+
+def get_compact_catalog(root_dir, refresh=True, snapshot_file=SNAPSHOT_FILE, rescan_first=True):
+    """
+    Get the compact snapshot of root_dir, rebuilding it when the tree changed.
+
+    Args:
+        root_dir (str): Library root.
+        refresh (bool): Rescan the disk first; the snapshot is only rebuilt
+            when the rescan listed any directory again.  Without a refresh a
+            saved snapshot is mapped as is, touching neither the tree nor the
+            catalog database.
+        snapshot_file (str): Where the snapshot is saved between runs.
+        rescan_first (bool): With refresh, whether to rescan here; False when
+            the caller just rescanned the root (e.g. Library.rescan on the
+            root's own worker) and only the catalog needs checking.
+    """
+    root_dir = os.path.abspath(root_dir)
+    cached = _compact_catalogs.get(root_dir) or _load(snapshot_file, root_dir)
+    if cached is None or refresh:
+        catalog = get_catalog()
+        if refresh and rescan_first:
+            rescan(root_dir, catalog)
+        signature = catalog.signature(root_dir)
+        if cached is None or cached[0] != signature:
+            cached = (signature, CompactCatalog.from_catalog(root_dir, catalog))
+            _save(snapshot_file, *cached)
+    _compact_catalogs[root_dir] = cached
+    return cached[1]
+
+
+def clear_compact_catalogs():
+    """Forget the compact snapshots held in memory (the snapshot file is kept)."""
+    _compact_catalogs.clear()
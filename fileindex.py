@@ -0,0 +1,343 @@
+import bisect
+import fnmatch
+import os
+import pickle
+import re
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog import LISTING_WORKERS
+from listing import scan_files
+from profiling import trace
+
+'''
+----------------------------
+Library-wide file name index
+-----------------------------
+
+Every file below the library root is recorded with its directory, size and
+mtime.  The names are kept in two newline separated strings (as found and
+lower-cased) with an offsets array, so a substring, prefix or glob query is
+a single str.find / regular expression pass over one buffer.  Files are laid
+out directory by directory, in sorted directory order, and each directory
+remembers the range of file ids it holds.
+
+Only these packed arrays and the per-directory mtimes and ranges are pickled
+to file_index.pickle (the lower-cased names are rebuilt on load).
+Refreshing the index stats every directory in parallel and lists again,
+through listing.scan_files, only those whose mtime changed; the files of
+every other directory are copied over as whole slices.  Files edited in
+place keep the size and mtime they were indexed with until their directory
+changes.
+'''
+
+FILE_INDEX_FILE = 'file_index.pickle'
+FILE_INDEX_VERSION = 2
+
+GLOB_CHARS = set('*?[')
+
+
+class FileIndex:
+    """Compact index of the files of a library, searchable by substring, prefix or glob."""
+
+    def __init__(self, root_dir):
+        self.root_dir = os.path.abspath(root_dir)
+        self.dirs = []                  # sorted relative directories
+        self.dir_mtimes = array('q')
+        self.dir_starts = array('q', [0])   # files of dirs[i] are ids dir_starts[i]:dir_starts[i + 1]
+        self.file_dir = array('I')
+        self.sizes = array('q')
+        self.mtimes = array('q')
+        self.offsets = array('q')
+        self.names = ''
+        self.lower_names = ''
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lower_names']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lower_names = self._lower(self.names)
+
+    @staticmethod
+    def _lower(names):
+        lowered = names.lower()
+        if len(lowered) == len(names):
+            return lowered
+        # A few characters (such as 'İ') get longer when lower-cased; in the
+        # names holding one, keep those characters as they are so that the
+        # offsets stay aligned and every other character still folds.
+        return '\n'.join(
+            name.lower() if len(name.lower()) == len(name)
+            else ''.join(char.lower() if len(char.lower()) == 1 else char for char in name)
+            for name in names.split('\n'))
+
+    def refresh(self, workers=LISTING_WORKERS):
+        """
+        Bring the index up to date with the disk.
+
+        Directories are walked level by level; each level is stat'ed in
+        parallel and only directories whose mtime changed are listed again.
+
+        Returns:
+            bool: True when anything changed.
+        """
+        probe, store = self.split_refresh(workers)
+        return store(probe())
+
+    def split_refresh(self, workers=LISTING_WORKERS):
+        """
+        Split refresh() for callers that schedule the disk access themselves.
+
+        Returns:
+            tuple: (probe, store). probe() walks the disk and lays the files
+            out again without changing the index, so it can run on any
+            thread; store(probe()) puts the result in place and returns
+            whether anything changed.
+        """
+        return (lambda: self._walk(workers)), self._install
+
+    def _install(self, packed):
+        if packed is None:
+            return False
+        self.__dict__.update(packed)
+        return True
+
+    def _walk(self, workers):
+        """Get the new packed attributes, or None when nothing changed."""
+        known = {relative: dir_id for dir_id, relative in enumerate(self.dirs)}
+        children = {}
+        for relative in self.dirs:
+            if relative:
+                children.setdefault(os.path.dirname(relative), []).append(relative)
+        found = {}                      # relative -> (mtime, FileStat list or None if unchanged)
+        level = ['']
+        changed = False
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while level:
+                results = list(pool.map(lambda relative: self._refresh_dir(relative, known, children),
+                                        level))
+                level = []
+                for relative, mtime, files, subdirs in results:
+                    if mtime is None:
+                        changed = True
+                        continue
+                    found[relative] = (mtime, files)
+                    changed = changed or files is not None
+                    level.extend(subdirs)
+        changed = changed or len(found) != len(self.dirs)
+        return self._pack(found, known) if changed else None
+
+    def _refresh_dir(self, relative, known, children):
+        """Get (relative, mtime or None if gone, new files or None if unchanged, relative subdirs)."""
+        path = os.path.join(self.root_dir, relative) if relative else self.root_dir
+        dir_id = known.get(relative)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if dir_id is not None and mtime == self.dir_mtimes[dir_id]:
+                return relative, mtime, None, children.get(relative, [])
+            listing = scan_files(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return relative, None, None, []
+        subdirs = [os.path.join(relative, name) if relative else name for name in listing.dirs]
+        return relative, mtime, listing.files, subdirs
+
+    def _pack(self, found, known):
+        """Lay the files out again, copying the slices of unchanged directories, as new attributes."""
+        dirs = sorted(found)
+        dir_mtimes, dir_starts = array('q'), array('q', [0])
+        file_dir, sizes, mtimes, offsets = array('I'), array('q'), array('q'), array('q')
+        names = []
+        offset = 0
+        for dir_id, relative in enumerate(dirs):
+            mtime, files = found[relative]
+            dir_mtimes.append(mtime)
+            if files is None:
+                old_id = known[relative]
+                start, stop = self.dir_starts[old_id], self.dir_starts[old_id + 1]
+                if stop > start:
+                    begin = self.offsets[start]
+                    end = self.offsets[stop] if stop < len(self.offsets) else len(self.names)
+                    names.append(self.names[begin:end])
+                    shift = offset - begin
+                    offsets.extend(old + shift for old in self.offsets[start:stop])
+                    sizes.extend(self.sizes[start:stop])
+                    mtimes.extend(self.mtimes[start:stop])
+                    offset += end - begin
+            else:
+                for name, size, file_mtime in files:
+                    offsets.append(offset)
+                    sizes.append(size)
+                    mtimes.append(file_mtime)
+                    names.append(name + '\n')
+                    offset += len(name) + 1
+            file_dir.extend(array('I', [dir_id]) * (len(offsets) - len(file_dir)))
+            dir_starts.append(len(offsets))
+        names = ''.join(names)
+        return {'dirs': dirs, 'dir_mtimes': dir_mtimes, 'dir_starts': dir_starts,
+                'file_dir': file_dir, 'sizes': sizes, 'mtimes': mtimes, 'offsets': offsets,
+                'names': names, 'lower_names': self._lower(names)}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _name(self, file_id):
+        start = self.offsets[file_id]
+        return self.names[start:self.names.index('\n', start)]
+
+    def _file_at(self, position):
+        return bisect.bisect_right(self.offsets, position) - 1
+
+    def record(self, file_id):
+        """Describe one indexed file as a dict."""
+        relative = self.dirs[self.file_dir[file_id]]
+        parts = relative.split(os.sep) if relative else []
+        name = self._name(file_id)
+        return {
+            'publisher': parts[0] if len(parts) > 0 else None,
+            'topic': parts[1] if len(parts) > 1 else None,
+            'chapter': parts[2] if len(parts) > 2 else None,
+            'file': name,
+            'directory': os.path.join(self.root_dir, relative),
+            'path': os.path.join(self.root_dir, relative, name),
+            'size': self.sizes[file_id],
+            'mtime': self.mtimes[file_id] / 1e9,
+        }
+
+    def _substring(self, query, limit):
+        ids = []
+        position = self.lower_names.find(query)
+        while position != -1 and (limit is None or len(ids) < limit):
+            file_id = self._file_at(position)
+            ids.append(file_id)
+            # Continue after the end of this name so each file is reported once.
+            position = self.lower_names.find(query, self.lower_names.index('\n', position) + 1)
+        return ids
+
+    def _name_starts(self, prefix):
+        """Yield the buffer positions of the names starting with prefix."""
+        names = self.lower_names
+        if names and names.startswith(prefix):
+            yield 0
+        found = names.find('\n' + prefix)
+        while found != -1 and found + 1 < len(names):
+            yield found + 1
+            found = names.find('\n' + prefix, found + 1)
+
+    def _prefix(self, prefix, limit):
+        ids = []
+        for position in self._name_starts(prefix):
+            ids.append(self._file_at(position))
+            if limit is not None and len(ids) >= limit:
+                break
+        return ids
+
+    def _glob(self, pattern, limit):
+        # fnmatch.translate anchors at the end with \Z; match line by line instead.
+        regex = fnmatch.translate(pattern)
+        regex = regex.replace('(?s:', '(?:').replace('\\Z', '$')
+        ids = []
+        for found in re.finditer('^' + regex, self.lower_names, re.MULTILINE):
+            ids.append(self._file_at(found.start()))
+            if limit is not None and len(ids) >= limit:
+                break
+        return ids
+
+    @trace('search')
+    def search(self, query, mode=None, limit=None):
+        """
+        Find files by name, case-insensitively.
+
+        Args:
+            query (str): Text or glob pattern.
+            mode (str): 'substring', 'prefix' or 'glob'. By default a query
+                with glob characters is a glob and anything else a substring.
+            limit (int): Maximum number of results.
+
+        Returns:
+            list: Result dicts (see record), in index order.
+        """
+        query = query.lower()
+        if mode is None:
+            mode = 'glob' if GLOB_CHARS & set(query) else 'substring'
+        if mode == 'glob':
+            literal = query[:-1]
+            if query.endswith('*') and not GLOB_CHARS & set(literal):
+                mode, query = 'prefix', literal
+        if mode == 'substring':
+            ids = self._substring(query, limit)
+        elif mode == 'prefix':
+            ids = self._prefix(query, limit)
+        elif mode == 'glob':
+            ids = self._glob(query, limit)
+        else:
+            raise ValueError(f"Unknown search mode '{mode}'.")
+        return [self.record(file_id) for file_id in ids]
+
+
+def _load(index_file, root_dir):
+    try:
+        with open(index_file, 'rb') as file:
+            version, index = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError, AttributeError):
+        return None
+    if version != FILE_INDEX_VERSION or index.root_dir != root_dir:
+        return None
+    return index
+
+
+def _save(index_file, index):
+    temp_file = f"{index_file}.tmp"
+    with open(temp_file, 'wb') as file:
+        pickle.dump((FILE_INDEX_VERSION, index), file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_file, index_file)
+
+
+_indexes = {}
+
+
+def _loaded(root_dir, index_file):
+    index = _indexes.get(root_dir)
+    if index is None:
+        index = _indexes[root_dir] = _load(index_file, root_dir) or FileIndex(root_dir)
+    return index
+
+
+def get_file_index(root_dir, index_file=FILE_INDEX_FILE, refresh=True):
+    """
+    Get the file index of root_dir, loading it from index_file and refreshing it.
+
+    Args:
+        refresh (bool): Walk the tree for changes; without it the index is
+            used as last saved, touching nothing but index_file.
+    """
+    index = _loaded(os.path.abspath(root_dir), index_file)
+    if refresh and index.refresh():
+        _save(index_file, index)
+    return index
+
+
+def split_file_index(root_dir, index_file=FILE_INDEX_FILE):
+    """
+    Split get_file_index(root_dir, index_file) like FileIndex.split_refresh.
+
+    Returns:
+        tuple: (probe, store); probe() raises FileNotFoundError if root_dir
+        is gone, and store(probe()) saves the index when it changed and
+        returns it.
+    """
+    root_dir = os.path.abspath(root_dir)
+    index = _loaded(root_dir, index_file)
+    walk, install = index.split_refresh()
+
+    def probe():
+        os.stat(root_dir)
+        return walk()
+
+    def store(packed):
+        if install(packed):
+            _save(index_file, index)
+        return index
+    return probe, store
@@ -0,0 +1,138 @@
+from collections import Counter
+from functools import lru_cache
+
+from profiling import trace
+
+'''
+----------------------------
+Fuzzy matching of menu choices
+-----------------------------
+
+The choices are normalised once (lower-cased) and their padded trigrams
+are indexed.  A query then only computes an edit distance for the few
+choices sharing the most trigrams with it, instead of running difflib's
+SequenceMatcher against every choice.  Shared trigrams are counted from the
+rarest up and counting stops after FUZZY_POSTINGS postings, so trigrams that
+nearly every choice has (" th", "the") do not make a query cost as much as
+scanning the whole list; the best FUZZY_POOL choices of that count are then
+ranked by all the trigrams they share with the query.
+'''
+
+# Rank of each kind of match, best first.
+EXACT, PREFIX, SUBSTRING, FUZZY = 3, 2, 1, 0
+
+# How many of the best trigram candidates get an exact edit distance.
+FUZZY_CANDIDATES = 50
+
+# How many postings a query may count before its commoner trigrams are skipped.
+FUZZY_POSTINGS = 5000
+
+# How many choices found through the rarest trigrams are compared on all of them.
+FUZZY_POOL = 4 * FUZZY_CANDIDATES
+
+
+def normalize(text):
+    """Get the key a choice or query is compared by."""
+    return text.lower()
+
+
+def padded_trigrams(key):
+    """Get the trigrams of a key padded so that short keys have trigrams too."""
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_levenshtein(a, b, max_distance):
+    """
+    Edit distance between a and b, giving up once it exceeds max_distance.
+
+    Returns:
+        int: The distance, or max_distance + 1 when it is larger than max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class FuzzyMatcher:
+    """Ranked case-insensitive matching of a query against a fixed list of choices."""
+
+    def __init__(self, choices):
+        self.choices = list(choices)
+        self.keys = [normalize(choice) for choice in self.choices]
+        self.postings = {}
+        for choice_id, key in enumerate(self.keys):
+            for gram in padded_trigrams(key):
+                self.postings.setdefault(gram, []).append(choice_id)
+
+    def _fuzzy(self, query, cutoff, limit):
+        """Get (similarity, id) pairs of the best fuzzy matches above cutoff."""
+        grams = padded_trigrams(query)
+        postings = sorted((self.postings[gram] for gram in grams if gram in self.postings), key=len)
+        shared = Counter()
+        budget = FUZZY_POSTINGS
+        for index, posting in enumerate(postings):
+            # Always count the rarest trigram so that a query made of common
+            # trigrams still finds candidates.
+            if index and len(posting) > budget:
+                break
+            shared.update(posting)
+            budget -= len(posting)
+        pool = [choice_id for choice_id, _ in shared.most_common(FUZZY_POOL)]
+        pool.sort(key=lambda choice_id: -len(grams & padded_trigrams(self.keys[choice_id])))
+        scored = []
+        for choice_id in pool[:FUZZY_CANDIDATES]:
+            key = self.keys[choice_id]
+            longest = max(len(key), len(query))
+            max_distance = int((1 - cutoff) * longest)
+            distance = bounded_levenshtein(query, key, max_distance)
+            if distance <= max_distance:
+                scored.append((1 - distance / longest, choice_id))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return scored[:limit]
+
+    @trace('match')
+    def match(self, query, fuzzy_limit=10, cutoff=0.5, limit=None):
+        """
+        Find the choices matching a query, best first.
+
+        Exact matches rank above prefix matches, then substring matches, then
+        fuzzy matches; ties are broken by similarity and then by choice order.
+        Every substring match is returned, plus at most fuzzy_limit fuzzy matches
+        with a similarity of at least cutoff.
+
+        Args:
+            query (str): Text typed by the user.
+            fuzzy_limit (int): Maximum number of fuzzy-only matches.
+            cutoff (float): Minimum similarity (0-1) of a fuzzy match.
+            limit (int): Maximum number of results, all by default.
+
+        Returns:
+            list: Matching choices, ranked.
+        """
+        query = normalize(query)
+        ranked = {}
+        for choice_id, key in enumerate(self.keys):
+            if query in key:
+                kind = EXACT if key == query else PREFIX if key.startswith(query) else SUBSTRING
+                ranked[choice_id] = (kind, len(query) / len(key) if key else 1.0)
+        for similarity, choice_id in self._fuzzy(query, cutoff, fuzzy_limit):
+            ranked.setdefault(choice_id, (FUZZY, similarity))
+        order = sorted(ranked, key=lambda choice_id: (-ranked[choice_id][0],
+                                                      -ranked[choice_id][1], choice_id))
+        return [self.choices[choice_id] for choice_id in order[:limit]]
+
+
+@lru_cache(maxsize=8)
+def get_matcher(choices):
+    """Get a matcher for a tuple of choices, reusing it while the same list is shown."""
+    return FuzzyMatcher(choices)
@@ -0,0 +1,269 @@
+import hashlib
+import os
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from catalog import PUBLISHER_PREFIXES, get_catalog
+from rootdir import CSV_FILE, resolve_root_directories
+
+'''
+----------------------------
+Libraries spread over several roots
+-----------------------------
+
+address.csv can name several library roots, one per row, for books spread
+over several volumes.  A Library merges the publishers of all of them into
+one list.  Each root gets its own worker thread that stats and lists it, and
+all roots are waited for together, up to ROOT_TIMEOUT seconds.  rescan does
+the same with a rescan of each root's whole tree, up to SCAN_TIMEOUT
+seconds, and the indexes are built from the catalog afterwards; only the
+storing of the results runs on the calling thread.  A root that does not answer in time (an offline or sleeping
+volume) is reported in unavailable and contributes the publishers the
+catalog last saw there; its worker keeps going in the background and is not
+started again until it finishes, so a hung volume never piles up threads.
+The menus refuse to browse into an unavailable root, since listing it on
+the main thread could hang them.
+
+Every root keeps its own catalog entries and its own index files, so the
+roots are cached independently.  The first root is the primary one: the menus
+are given its path and look the Library up with get_library.
+'''
+
+ROOT_TIMEOUT = float(os.environ.get('VIEWER_ROOT_TIMEOUT', 2.0))
+
+# How long a rescan of a whole root may take before the root counts as stalled.
+SCAN_TIMEOUT = float(os.environ.get('VIEWER_SCAN_TIMEOUT', 10.0))
+
+# A publisher as shown in the merged list: its label and its directory.
+Publisher = namedtuple('Publisher', ['name', 'path'])
+
+
+class Library:
+    """The merged view of one or more library roots."""
+
+    def __init__(self, roots, timeout=ROOT_TIMEOUT, scan_timeout=SCAN_TIMEOUT):
+        self.roots = list(dict.fromkeys(os.path.abspath(root) for root in roots))
+        if not self.roots:
+            raise ValueError("A library needs at least one root directory.")
+        self.timeout = timeout
+        self.scan_timeout = scan_timeout
+        self.pending = {}           # (kind, root) -> (future of its probe, function storing the result)
+        self.unavailable = []       # roots that did not answer during the last refresh
+        self.paths = {}             # publisher label -> publisher directory
+
+    @property
+    def root(self):
+        """The primary root."""
+        return self.roots[0]
+
+    def refresh(self):
+        """
+        Validate every root concurrently, each on its own worker.
+
+        Returns:
+            list: The roots that answered within the timeout.
+        """
+        return list(self.run_on_roots('root', get_catalog().split_update))
+
+    def rescan(self, depth=None):
+        """
+        Rescan the whole tree of every root, each on its own worker.
+
+        Run this before building the per-root indexes, then build them without
+        a rescan of their own, so that a volume that answers at the top and
+        stalls further down cannot block the menus.
+
+        Args:
+            depth (int): How many levels to rescan, all by default (1 for
+                the publishers only).
+
+        Returns:
+            dict: root -> DirChanges, for the roots that answered within the timeout.
+        """
+        catalog = get_catalog()
+        return self.run_on_roots(('tree', depth), lambda root: catalog.split_rescan(root, depth),
+                                 self.scan_timeout if depth is None else self.timeout)
+
+    def run_on_roots(self, kind, split, timeout=None):
+        """
+        Run split(root) -> (probe, store) for every root.
+
+        Each probe runs on a worker of its own and they are all waited for
+        together up to timeout (the root timeout by default); the results
+        are stored on this thread.  A root whose probe is still running from
+        an earlier call, of any kind, is unavailable without waiting for it
+        again, so every redraw does not pay for a dead volume.
+
+        Args:
+            kind: Names the job, e.g. 'root'; a root runs at most one probe
+                of each kind at a time.
+
+        Returns:
+            dict: root -> what store returned, for the roots that answered.
+        """
+        started = set()
+        for root in self.roots:
+            if (kind, root) not in self.pending:
+                probe, store = split(root)
+                self.pending[(kind, root)] = (_run_in_background(probe), store)
+                started.add(root)
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        results, failed = {}, set()
+        for root in self.roots:
+            future, store = self.pending[(kind, root)]
+            if root not in started and not future.done():
+                failed.add(root)
+                continue
+            try:
+                result = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeout:
+                failed.add(root)
+                continue
+            except OSError:
+                del self.pending[(kind, root)]
+                failed.add(root)
+                continue
+            del self.pending[(kind, root)]
+            results[root] = store(result)
+        failed.update(root for (_, root), (future, _) in self.pending.items() if not future.done())
+        self.unavailable = [root for root in self.roots if root in failed]
+        return {root: result for root, result in results.items() if root not in failed}
+
+    def available_roots(self):
+        """Get the roots that answered during the last refresh."""
+        return [root for root in self.roots if root not in self.unavailable]
+
+    def root_of(self, path):
+        """Get the root a path is in, or None if it is outside the library."""
+        path = os.path.abspath(path)
+        for root in self.roots:
+            if path == root or path.startswith(os.path.join(root, '')):
+                return root
+        return None
+
+    def is_available(self, path):
+        """Tell whether a path is safe to browse, i.e. not in a root that stopped answering."""
+        return self.root_of(path) not in self.unavailable
+
+    def publishers(self, prefixes=PUBLISHER_PREFIXES):
+        """
+        Get the merged, sorted publishers of every root.
+
+        A publisher name found in several roots is listed once per root, with
+        the root's name in brackets.  Check unavailable afterwards for roots
+        whose publishers may be out of date.
+
+        Returns:
+            list: Publisher (label, path) entries.
+        """
+        self.refresh()
+        catalog = get_catalog()
+        found = [(name, order, root) for order, root in enumerate(self.roots)
+                 for name in catalog.children(root) if name.startswith(tuple(prefixes))]
+        counts = Counter(name for name, _, _ in found)
+        publishers = []
+        for name, _, root in sorted(found):
+            label = name if counts[name] == 1 else f"{name} ({os.path.basename(root)})"
+            publishers.append(Publisher(label, os.path.join(root, name)))
+        self.paths = {publisher.name: publisher.path for publisher in publishers}
+        return publishers
+
+    def publisher_path(self, name):
+        """Get the directory of a publisher label from the last publishers() listing."""
+        return self.paths.get(name) or os.path.join(self.root, name)
+
+    def collect(self, lookup, roots=None):
+        """
+        Merge per-root (publisher, topic) results over the roots that answered.
+
+        Args:
+            lookup (callable): lookup(root) returns (publisher, topic) pairs
+                of one root, e.g. from its tag or topic index.
+            roots (iterable): Roots to merge, e.g. those a rescan returned;
+                by default those that answered the last refresh.
+
+        Returns:
+            list: Sorted (publisher label, topic) pairs, for listed publishers only.
+        """
+        if not self.paths:
+            self.publishers()
+        labels = {path: name for name, path in self.paths.items()}
+        results = []
+        for root in (self.available_roots() if roots is None else roots):
+            for publisher, topic in lookup(root):
+                label = labels.get(os.path.join(root, publisher))
+                if label is not None:
+                    results.append((label, topic))
+        return sorted(results)
+
+    def listed_in(self, root):
+        """Get the names of the publishers listed from one root."""
+        if not self.paths:
+            self.publishers()
+        return {os.path.basename(path) for path in self.paths.values()
+                if os.path.dirname(path) == root}
+
+    def cache_file(self, file_name, root):
+        """Get the name of the per-root copy of a cache file such as 'topic_index.pickle'."""
+        if root == self.root:
+            return file_name
+        stem, extension = os.path.splitext(file_name)
+        digest = hashlib.sha1(os.fsencode(root)).hexdigest()[:8]
+        return f"{stem}.{digest}{extension}"
+
+
+def _run_in_background(function):
+    """
+    Run function on a new daemon thread and get a Future of its result.
+
+    Daemon threads rather than an executor, so that a stat stuck on a dead
+    volume cannot keep the process from exiting.
+    """
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(function())
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, name='root-scan', daemon=True).start()
+    return future
+
+
+def print_unavailable(library, file=None):
+    """Flag the roots whose publishers may be missing or out of date."""
+    for root in library.unavailable:
+        print(f"\nNote: '{root}' did not respond; its publishers are shown as last seen.", file=file)
+
+
+_libraries = {}
+
+
+def open_library(roots, timeout=ROOT_TIMEOUT, scan_timeout=SCAN_TIMEOUT):
+    """Create the Library of several roots and make get_library(primary root) return it."""
+    library = Library(roots, timeout, scan_timeout)
+    _libraries[library.root] = library
+    return library
+
+
+def get_library(root_dir):
+    """Get the Library whose primary root is root_dir, a single-root one if none was opened."""
+    root_dir = os.path.abspath(root_dir)
+    if root_dir not in _libraries:
+        _libraries[root_dir] = Library([root_dir])
+    return _libraries[root_dir]
+
+
+def resolve_library_root(csv_file=CSV_FILE, start_dir=None, roots=None):
+    """
+    Open the Library of every root listed in csv_file and get its primary root.
+
+    Args:
+        roots (list): Root directories to use instead of those in csv_file,
+            e.g. from a --root option.
+    """
+    if roots:
+        return open_library([os.path.abspath(root) for root in roots]).root
+    return open_library(resolve_root_directories(csv_file, start_dir)).root
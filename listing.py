@@ -0,0 +1,83 @@
+import os
+from collections import namedtuple
+
+from profiling import trace
+
+'''
+----------------------------
+Directory listing
+-----------------------------
+
+A single os.scandir pass per directory.  The entry types come from the
+directory read itself (d_type on Linux and macOS, the find data on Windows),
+so telling sub-directories from files costs no extra stat per entry; only
+symlinks and filesystems that do not report a type fall back to a stat.
+
+Sub-directory inode numbers, which the catalog uses to recognise renames,
+also come from the directory read on POSIX.  On Windows os.scandir would
+need a stat per entry to get them, so they are left out (None) there and
+a renamed directory is treated as removed and added.
+
+scan_files lists a directory the same way for the file name index, which
+also needs the size and mtime of every file.
+'''
+
+# Whether DirEntry.inode() is free, i.e. read from the directory itself.
+INODES_FROM_LISTING = os.name != 'nt'
+
+# dirs maps each sub-directory name to its inode number (or None), files lists file names.
+DirListing = namedtuple('DirListing', ['dirs', 'files'])
+
+FileStat = namedtuple('FileStat', ['name', 'size', 'mtime'])
+
+
+@trace('listdir')
+def scan_directory(path):
+    """
+    List a directory in one pass.
+
+    Args:
+        path (str): Directory to list.
+
+    Returns:
+        DirListing: Sub-directories (name -> inode or None) and file names.
+    """
+    dirs, files = {}, []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    dirs[entry.name] = entry.inode() if INODES_FROM_LISTING else None
+                elif entry.is_file():
+                    files.append(entry.name)
+            except OSError:
+                # Broken symlink or entry removed while listing.
+                continue
+    return DirListing(dirs, files)
+
+
+@trace('listdir')
+def scan_files(path):
+    """
+    List a directory in one pass, with the size and mtime of every file.
+
+    Args:
+        path (str): Directory to list.
+
+    Returns:
+        DirListing: Sub-directories (name -> inode or None) and FileStat
+            tuples sorted by name.  Names containing a newline are skipped.
+    """
+    dirs, files = {}, []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    dirs[entry.name] = entry.inode() if INODES_FROM_LISTING else None
+                elif entry.is_file() and '\n' not in entry.name:
+                    stat = entry.stat()
+                    files.append(FileStat(entry.name, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                continue
+    files.sort()
+    return DirListing(dirs, files)
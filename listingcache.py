@@ -0,0 +1,161 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from profiling import count
+
+'''
+----------------------------
+Short-lived cache of directory listings
+-----------------------------
+
+The menus redraw the same screens over and over: going back from a topic's
+chapters and into the topic again lists it again.  The catalog already
+turns each of those into a stat plus a database query; this cache, shared
+by every menu, makes them free for a while.
+
+Sub-directory lists and file counts are kept per path for LISTING_TTL
+seconds without touching the disk.  An expired entry is checked with one
+stat and kept for another LISTING_TTL if the directory mtime is unchanged.
+The cache is a bounded LRU: the least recently used entries are dropped
+once there are more than LISTING_CACHE_ENTRIES of them or their estimated
+size exceeds LISTING_CACHE_BYTES.  The catalog drops the entries of every
+directory it lists again, so changes it notices (for instance from the
+watcher) are never hidden by the cache.
+
+stats() reports hits, misses and evictions for tuning the limits, and with
+profiling on every hit and miss is also counted for the screen it was on.
+'''
+
+LISTING_TTL = float(os.environ.get('VIEWER_LISTING_TTL', 10.0))
+LISTING_CACHE_ENTRIES = int(os.environ.get('VIEWER_LISTING_CACHE_ENTRIES', 2048))
+LISTING_CACHE_BYTES = int(os.environ.get('VIEWER_LISTING_CACHE_BYTES', 8 * 1024 * 1024))
+
+
+def _size(value):
+    """Estimate the memory held by a cached value."""
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class ListingCache:
+    """Bounded LRU of per-directory values with a TTL and mtime validation."""
+
+    def __init__(self, ttl=LISTING_TTL, max_entries=LISTING_CACHE_ENTRIES,
+                 max_bytes=LISTING_CACHE_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # (kind, path) -> [expires, mtime, value, size]
+        self.kinds = set()
+        self.nbytes = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, kind, path):
+        """
+        Get a cached value, or None if it is missing or stale.
+
+        Args:
+            kind (str): What is cached, e.g. 'subdirs' or 'file_count'.
+            path (str): Absolute directory path.
+        """
+        key = (kind, path)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return self._miss()
+        now = time.monotonic()
+        if now >= entry[0]:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            with self.lock:
+                if mtime is None or mtime != entry[1]:
+                    self._drop(key)
+                    stale = True
+                else:
+                    entry[0] = now + self.ttl
+                    self.revalidated += 1
+                    stale = False
+            if stale:
+                return self._miss()
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.hits += 1
+        count('listing_cache.hit')
+        return entry[2]
+
+    def _miss(self):
+        with self.lock:
+            self.misses += 1
+        count('listing_cache.miss')
+        return None
+
+    def put(self, kind, path, mtime, value):
+        """Cache a value read from a directory whose mtime was mtime."""
+        if self.ttl <= 0 or mtime is None:
+            return
+        size = _size(value)
+        with self.lock:
+            self.kinds.add(kind)
+            self._drop((kind, path))
+            self.entries[(kind, path)] = [time.monotonic() + self.ttl, mtime, value, size]
+            self.nbytes += size
+            while self.entries and (len(self.entries) > self.max_entries
+                                    or self.nbytes > self.max_bytes):
+                _, (_, _, _, dropped) = self.entries.popitem(last=False)
+                self.nbytes -= dropped
+                self.evictions += 1
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[3]
+
+    def invalidate(self, path, subtree=False):
+        """Forget everything cached for one directory, and with subtree for all below it."""
+        prefix = os.path.join(path, '')
+        with self.lock:
+            if subtree:
+                keys = [key for key in self.entries if key[1] == path or key[1].startswith(prefix)]
+            else:
+                keys = [(kind, path) for kind in self.kinds]
+            for key in keys:
+                self._drop(key)
+
+    def clear(self):
+        """Forget every entry; the statistics are kept."""
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """Get the counters and the current size, for tuning the limits."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'hits': self.hits,
+                'revalidated': self.revalidated,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = ListingCache()
+
+
+def get_listing_cache():
+    """Get the listing cache shared by all menus."""
+    return _cache
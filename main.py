@@ -1,7 +1,15 @@
+import argparse
 import subprocess
 from os import system
 import platform
 
+import menuName
+import menuNum
+import search
+import profiling
+from library import resolve_library_root
+from watcher import start_watcher
+
 '''
 ----------------------------
 For Windows , Mac and Linux
@@ -27,17 +35,43 @@ def display_menu():
     print("3. Search")
     print("4. Exit")
 
+# The three modes run in this process and share its catalog and caches.
+MODES = {
+    '1': menuNum.menu,
+    '2': menuName.menu,
+    '3': search.menu,
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Browse the myBooks library.")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep the catalog live by watching the library for changes")
+    parser.add_argument('--profile', metavar='TRACE_FILE',
+                        help="count and time listings, stats, opens and matching per screen "
+                             "and write a Chrome trace to TRACE_FILE")
+    parser.add_argument('--root', action='append', metavar='DIR',
+                        help="library root to use instead of those in address.csv (repeatable)")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    if args.profile:
+        profiling.enable(args.profile)
+    try:
+        root_dir = resolve_library_root(roots=args.root)
+    except (FileNotFoundError, ValueError) as e:
+        print(e)
+        return
+
+    if args.watch:
+        start_watcher(root_dir)
+
     while True:
         display_menu()
         choice = input("Enter your choice (1-4): ")
         
-        if choice == '1':
-            subprocess.run(['python', 'menuNum.py'])
-        elif choice == '2':
-            subprocess.run(['python', 'menuName.py'])
-        elif choice == '3':
-            subprocess.run(['python', 'search.py'])
+        if choice in MODES:
+            MODES[choice](root_dir)
         elif choice == '4':
             print("Exiting...")
             break
@@ -1,55 +1,16 @@
 import os
 import subprocess
 import sys
-import csv
+from collections import Counter
 
+from bulktags import retag, write_tags
+from catalog import get_topics as list_topics, parse_tags
+from chapters import chapters_screen
+from library import get_library, print_unavailable, resolve_library_root
+from tagindex import get_tag_index, tags_saved
+from pager import navigate, page_bounds, print_page_footer
+from profiling import screen
 
-# ----------------------------------------------
-def get_directory_name_from_csv(csv_file):
-    """
-    Get the directory name from the first row of the CSV file.
-    
-    Args:
-        csv_file (str): Path to the CSV file.
-    
-    Returns:
-        str: The directory name from the first row.
-    """
-    try:
-        with open(csv_file, mode='r') as file:
-            reader = csv.reader(file)
-            first_row = next(reader, None)
-            if first_row and first_row[0]:
-                return first_row[0]
-            else:
-                raise ValueError("CSV file is empty or has no valid rows.")
-    except Exception as e:
-        print(f"Error reading CSV file: {e}")
-        raise
-
-def find_root_directory(start_dir, target_dir_name):
-    """Find the target directory starting from the start_dir and moving up through parent directories."""
-    current_dir = os.path.abspath(start_dir)
-    while True:
-        potential_root = os.path.join(current_dir, target_dir_name)
-        if os.path.isdir(potential_root):
-            return potential_root
-        parent_dir = os.path.dirname(current_dir)
-        if parent_dir == current_dir:
-            break
-        current_dir = parent_dir
-    raise FileNotFoundError(f"Directory '{target_dir_name}' not found.")
-    
-#----------------------------------------------    
-    
-
-def find_tag_files(root_dir):
-    """Find all 'tag.txt' files in the directory tree starting from root_dir."""
-    tag_files = []
-    for root, dirs, files in os.walk(root_dir):
-        if 'tag.txt' in files:
-            tag_files.append(os.path.join(root, 'tag.txt'))
-    return tag_files
 
 def load_tags_from_file(tag_file_path):
     """Load tags from the given tag file path."""
@@ -60,9 +21,8 @@ def load_tags_from_file(tag_file_path):
     return [tag.strip() for tag in line.split(',') if tag.strip()]
 
 def save_tags_to_file(tag_file_path, tags):
-    """Save tags to the given tag file path."""
-    with open(tag_file_path, 'w') as file:
-        file.write(', '.join(tags))
+    """Save tags to the given tag file path, replacing it atomically."""
+    write_tags(os.path.dirname(tag_file_path), tags)
 
 def create_or_edit_tag_file(directory):
     """Create or edit the 'tag.txt' file in the specified directory."""
@@ -81,63 +41,84 @@ def create_or_edit_tag_file(directory):
     new_tags = input("Enter new tags separated by commas: ").strip()
     new_tags_list = [tag.strip() for tag in new_tags.split(',') if tag.strip()]
     save_tags_to_file(tag_file_path, new_tags_list)
+    tags_saved(directory)
     print("Tags updated successfully.")
     input("Press Enter to continue...")
 
-def get_publishers(root_dir):
-    """Get a list of publishers that start with certain prefixes."""
-    prefixes = ('$_', '$__', '#_', '#__', '__')
-    publishers = [d for d in os.listdir(root_dir)
-                  if os.path.isdir(os.path.join(root_dir, d)) and d.startswith(prefixes)]
-    return sorted(publishers)
+def parse_selection(selection, count):
+    """
+    Turn a selection such as '1-5, 8' or 'all' into 0-based indexes.
+
+    Raises:
+        ValueError: If a number is not between 1 and count.
+    """
+    if selection.strip().lower() == 'all':
+        return list(range(count))
+    indexes = set()
+    for part in selection.split(','):
+        first, _, last = part.partition('-')
+        first = int(first)
+        last = int(last) if last.strip() else first
+        if not 1 <= first <= last <= count:
+            raise ValueError(f"'{part.strip()}' is not within 1-{count}.")
+        indexes.update(range(first - 1, last))
+    return sorted(indexes)
+
+def bulk_retag(topic_paths):
+    """Ask which of the topics to retag and which tags to add and remove, then apply it to all of them."""
+    selection = input("Enter the topic numbers (e.g. '1-5, 8') or 'all': ").strip()
+    try:
+        selected = [topic_paths[index] for index in parse_selection(selection, len(topic_paths))]
+    except ValueError as e:
+        print(f"Invalid selection: {e}")
+        input("Press Enter to continue...")
+        return
+    add = parse_tags(input("Enter tags to add separated by commas (or leave empty): "))
+    remove = parse_tags(input("Enter tags to remove separated by commas (or leave empty): "))
+    if not add and not remove:
+        print("No tags to add or remove.")
+    else:
+        changed, failed = retag(selected, add, remove)
+        print(f"Tags updated for {len(changed)} of {len(selected)} topics.")
+        for directory, error in failed:
+            print(f"Could not retag {directory}: {error}")
+    input("Press Enter to continue...")
 
 def get_topics(publisher_path, tags=None):
     """Get a list of topics under a publisher, optionally filtered by tags."""
-    topics = [d for d in os.listdir(publisher_path) if os.path.isdir(os.path.join(publisher_path, d))]
+    topics = list_topics(publisher_path)
     if tags:
-        tagged_topics = set()
-        for topic in topics:
-            topic_path = os.path.join(publisher_path, topic)
-            tag_files = find_tag_files(topic_path)
-            for tag_file in tag_files:
-                topic_tags = load_tags_from_file(tag_file)
-                if any(tag in topic_tags for tag in tags):
-                    tagged_topics.add(topic)
-        return sorted(tagged_topics)
-    return sorted(topics)
-
-def get_chapters(topic_path):
-    """Get a list of chapters under a topic."""
-    return sorted([d for d in os.listdir(topic_path) if os.path.isdir(os.path.join(topic_path, d))])
-
-def count_files(chapter_path):
-    """Count files in a chapter."""
-    return len([f for f in os.listdir(chapter_path) if os.path.isfile(os.path.join(chapter_path, f))])
+        root_dir, publisher = os.path.split(os.path.abspath(publisher_path))
+        listed = set(topics)
+        return [topic for topic_publisher, topic in get_tag_index(root_dir).query(any_of=tags)
+                if topic_publisher == publisher and topic in listed]
+    return topics
 
-def display_publishers(root_dir):
-    """Display the list of publishers."""
-    publishers = get_publishers(root_dir)
+@screen('menuNum.display_publishers')
+def display_publishers(root_dir, page=0):
+    """Display one page of the merged list of publishers of every library root."""
+    library = get_library(root_dir)
+    publishers = library.publishers()
+    page, start, stop = page_bounds(len(publishers), page)
     print("\nAvailable Publishers:")
-    for index, publisher in enumerate(publishers):
-        print(f"{index + 1}. {publisher}")
+    for index in range(start, stop):
+        print(f"{index + 1}. {publishers[index].name}")
+    print_page_footer(page, len(publishers))
+    print_unavailable(library)
     return publishers
 
-def display_topics(publisher_path):
-    """Display the list of topics under a selected publisher."""
+@screen('menuNum.display_topics')
+def display_topics(publisher_path, page=0):
+    """Display one page of the list of topics under a selected publisher."""
     topics = get_topics(publisher_path)
+    page, start, stop = page_bounds(len(topics), page)
     print("\nAvailable Topics:")
-    for index, topic in enumerate(topics):
-        print(f"{index + 1}. {topic}")
+    for index in range(start, stop):
+        print(f"{index + 1}. {topics[index]}")
+    print_page_footer(page, len(topics))
     return topics
 
-def display_chapters(topic_path):
-    """Display the list of chapters under a selected topic."""
-    chapters = get_chapters(topic_path)
-    print("\nAvailable Chapters:")
-    for index, chapter in enumerate(chapters):
-        file_count = count_files(os.path.join(topic_path, chapter))
-        print(f"{index + 1}. [{file_count} Files] - {chapter}")
-    return chapters
+display_chapters = chapters_screen('menuNum.display_chapters')
 
 def open_directory(path):
     """Open the directory in the file explorer."""
@@ -150,31 +131,53 @@ def clear_screen():
     """Clear the terminal screen."""
     os.system('cls' if os.name == 'nt' else 'clear')
 
+def tag_indexes(root_dir):
+    """Get the tag index of every library root that answered, rescanning each root on its own worker."""
+    return {root: get_tag_index(root, rescan_first=False)
+            for root in get_library(root_dir).rescan()}
+
+@screen('menuNum.filter_topics_by_tags')
 def filter_topics_by_tags(root_dir, tags):
     """Filter topics by the provided tags across all publishers."""
-    filtered_topics = []
-    publishers = get_publishers(root_dir)
-    for publisher in publishers:
-        publisher_path = os.path.join(root_dir, publisher)
-        topics = get_topics(publisher_path, tags)
-        for topic in topics:
-            filtered_topics.append((publisher, topic))
-    return filtered_topics
+    indexes = tag_indexes(root_dir)
+    return get_library(root_dir).collect(lambda root: indexes[root].query(any_of=tags), indexes)
+
+@screen('menuNum.filter_topics_by_query')
+def filter_topics_by_query(root_dir, expression):
+    """Filter topics across all publishers by a tag query such as "exam, 2024, -draft"."""
+    indexes = tag_indexes(root_dir)
+    return get_library(root_dir).collect(lambda root: indexes[root].search(expression), indexes)
+
+def tag_counts(root_dir):
+    """
+    Get every tag of the listed publishers with the number of topics carrying it.
+
+    Returns:
+        tuple: (sorted tags, dict of tag -> topic count).
+    """
+    library = get_library(root_dir)
+    all_tags, counts = set(), Counter()
+    for root, tag_index in tag_indexes(root_dir).items():
+        all_tags.update(tag_index.all_tags())
+        counts.update(tag_index.counts(library.listed_in(root)))
+    return sorted(all_tags), counts
 
 def menu(root_dir):
+    publisher_page = 0
     while True:
         clear_screen()
-        publishers = display_publishers(root_dir)
+        publishers = display_publishers(root_dir, publisher_page)
         choice = input("\nEnter the number, 'tags', 'exit' : ").strip()
+        new_page = navigate(choice, publisher_page, len(publishers))
+        if new_page is not None:
+            publisher_page = new_page
+            continue
         
         if choice.lower() == 'exit':
             break
         elif choice.lower() == 'tags':
-            # Find all 'tag.txt' files in the directory tree and collect unique tags
-            tag_files = find_tag_files(root_dir)
-            all_tags = set()
-            for tag_file in tag_files:
-                all_tags.update(load_tags_from_file(tag_file))
+            # Collect unique tags and their topic counts from the tag indexes
+            all_tags, counts = tag_counts(root_dir)
             
             if not all_tags:
                 print("No tags available to filter by.")
@@ -183,94 +186,124 @@ def menu(root_dir):
 
             clear_screen()
             print("\nAvailable Tags:")
-            for index, tag in enumerate(sorted(all_tags)):
-                print(f"{index + 1}. {tag}")
+            for index, tag in enumerate(all_tags):
+                print(f"{index + 1}. {tag} ({counts.get(tag, 0)} topics)")
             
-            tag_choice = input("\nEnter the number, 'back' : ").strip()
+            tag_choice = input("\nEnter the number, a tag query (e.g. 'exam, 2024, -draft' or 'sol*'), 'back' : ").strip()
             
             if tag_choice.lower() == 'back':
                 continue
             
             try:
-                tag_index = int(tag_choice) - 1
-                if 0 <= tag_index < len(all_tags):
-                    selected_tag = sorted(all_tags)[tag_index]
-                    filtered_topics = filter_topics_by_tags(root_dir, [selected_tag])
+                if tag_choice.isdigit() and 0 < int(tag_choice) <= len(all_tags):
+                    selected_tag = all_tags[int(tag_choice) - 1]
+                    refilter = lambda: filter_topics_by_tags(root_dir, [selected_tag])
+                    title = f"with the tag '{selected_tag}'"
+                else:
+                    refilter = lambda: filter_topics_by_query(root_dir, tag_choice)
+                    title = f"matching '{tag_choice}'"
+                filtered_topics = refilter()
+            except ValueError as e:
+                print(e)
+                input("Press Enter to continue...")
+                continue
+            
+            try:
+                if not filtered_topics:
+                    print(f"No topics found {title}.")
+                    input("Press Enter to continue...")
+                    continue
+                
+                topic_page = 0
+                while True:
+                    clear_screen()
+                    print(f"\nTopics {title}:")
+                    topic_page, start, stop = page_bounds(len(filtered_topics), topic_page)
+                    for index in range(start, stop):
+                        publisher, topic = filtered_topics[index]
+                        print(f"{index + 1}. [{publisher} ] ➡ {topic}")
+                    print_page_footer(topic_page, len(filtered_topics))
                     
-                    if not filtered_topics:
-                        print(f"No topics found with the tag '{selected_tag}'.")
-                        input("Press Enter to continue...")
+                    topic_choice = input("\nEnter the number, 'back', 'edit', 'open', 'retag' : ").strip()
+                    new_page = navigate(topic_choice, topic_page, len(filtered_topics))
+                    if new_page is not None:
+                        topic_page = new_page
                         continue
                     
-                    while True:
-                        clear_screen()
-                        print(f"\nTopics with the tag '{selected_tag}':")
-                        for index, (publisher, topic) in enumerate(filtered_topics):
-                            print(f"{index + 1}. [{publisher} ] ➡ {topic}")
-                        
-                        topic_choice = input("\nEnter the number, 'back', 'edit', 'open' : ").strip()
-                        
-                        if topic_choice.lower() == 'back':
+                    if topic_choice.lower() == 'back':
+                        break
+                    elif topic_choice.lower() == 'retag':
+                        library = get_library(root_dir)
+                        bulk_retag([os.path.join(library.publisher_path(publisher), topic)
+                                    for publisher, topic in filtered_topics])
+                        # Retagged topics may no longer match the filter, or new ones may.
+                        filtered_topics = refilter()
+                        if not filtered_topics:
+                            print(f"No topics found {title} any more.")
+                            input("Press Enter to continue...")
                             break
-                        elif topic_choice.lower() == 'open':
-                            # Open the publisher directory
-                            publisher_index = int(input("Enter the number to open: ").strip()) - 1
-                            if 0 <= publisher_index < len(publishers):
-                                publisher_path = os.path.join(root_dir, publishers[publisher_index])
-                                open_directory(publisher_path)
-                                input("Press Enter to return to the topic selection...")
+                        continue
+                    elif topic_choice.lower() == 'open':
+                        # Open the publisher directory
+                        publisher_index = int(input("Enter the number to open: ").strip()) - 1
+                        if 0 <= publisher_index < len(publishers):
+                            publisher_path = publishers[publisher_index].path
+                            open_directory(publisher_path)
+                            input("Press Enter to return to the topic selection...")
+                        continue
+                    elif topic_choice.lower() == 'edit':
+                        # Edit tags for the selected topic
+                        topic_index = int(input("Enter the number to edit tags for: ").strip()) - 1
+                        if 0 <= topic_index < len(filtered_topics):
+                            publisher, topic = filtered_topics[topic_index]
+                            topic_path = os.path.join(get_library(root_dir).publisher_path(publisher), topic)
+                            create_or_edit_tag_file(topic_path)
                             continue
-                        elif topic_choice.lower() == 'edit':
-                            # Edit tags for the selected topic
-                            topic_index = int(input("Enter the number to edit tags for: ").strip()) - 1
-                            if 0 <= topic_index < len(filtered_topics):
-                                publisher, topic = filtered_topics[topic_index]
-                                topic_path = os.path.join(root_dir, publisher, topic)
-                                create_or_edit_tag_file(topic_path)
-                                continue
-                            else:
-                                print("Invalid topic number.")
-                                input("Press Enter to continue...")
-                                continue
-                        
-                        try:
-                            topic_index = int(topic_choice) - 1
-                            if 0 <= topic_index < len(filtered_topics):
-                                publisher, topic = filtered_topics[topic_index]
-                                topic_path = os.path.join(root_dir, publisher, topic)
-                                while True:
-                                    clear_screen()
-                                    chapters = display_chapters(topic_path)
-                                    chapter_choice = input("\nEnter the number, 'open', 'edit', 'back' : ").strip()
-                                    
-                                    if chapter_choice.lower() == 'back':
-                                        break
-                                    elif chapter_choice.lower() == 'open':
-                                        open_directory(topic_path)
-                                        input("Press Enter to return to the chapter selection...")
-                                        continue
-                                    elif chapter_choice.lower() == 'edit':
-                                        create_or_edit_tag_file(topic_path)
-                                        continue
-                                    elif chapter_choice.lower() == 'exit':
-                                        return
-                                    else:
-                                        try:
-                                            chapter_index = int(chapter_choice) - 1
-                                            if 0 <= chapter_index < len(chapters):
-                                                chapter_path = os.path.join(topic_path, chapters[chapter_index])
-                                                open_directory(chapter_path)
-                                            else:
-                                                print("Invalid chapter number.")
-                                        except ValueError:
-                                            print("Invalid input.")
-                                        input("Press Enter to continue...")
-                        except ValueError:
-                            print("Invalid input.")
+                        else:
+                            print("Invalid topic number.")
                             input("Press Enter to continue...")
-                else:
-                    print("Invalid tag number.")
-                    input("Press Enter to continue...")
+                            continue
+                    
+                    try:
+                        topic_index = int(topic_choice) - 1
+                        if 0 <= topic_index < len(filtered_topics):
+                            publisher, topic = filtered_topics[topic_index]
+                            topic_path = os.path.join(get_library(root_dir).publisher_path(publisher), topic)
+                            chapter_page = 0
+                            while True:
+                                clear_screen()
+                                chapters = display_chapters(topic_path, chapter_page)
+                                chapter_choice = input("\nEnter the number, 'open', 'edit', 'back' : ").strip()
+                                new_page = navigate(chapter_choice, chapter_page, len(chapters))
+                                if new_page is not None:
+                                    chapter_page = new_page
+                                    continue
+                                
+                                if chapter_choice.lower() == 'back':
+                                    break
+                                elif chapter_choice.lower() == 'open':
+                                    open_directory(topic_path)
+                                    input("Press Enter to return to the chapter selection...")
+                                    continue
+                                elif chapter_choice.lower() == 'edit':
+                                    create_or_edit_tag_file(topic_path)
+                                    continue
+                                elif chapter_choice.lower() == 'exit':
+                                    return
+                                else:
+                                    try:
+                                        chapter_index = int(chapter_choice) - 1
+                                        if 0 <= chapter_index < len(chapters):
+                                            chapter_path = os.path.join(topic_path, chapters[chapter_index])
+                                            open_directory(chapter_path)
+                                        else:
+                                            print("Invalid chapter number.")
+                                    except ValueError:
+                                        print("Invalid input.")
+                                    input("Press Enter to continue...")
+                    except ValueError:
+                        print("Invalid input.")
+                        input("Press Enter to continue...")
             except ValueError:
                 print("Invalid input. Please enter a number.")
                 input("Press Enter to continue...")
@@ -278,14 +311,26 @@ def menu(root_dir):
             try:
                 publisher_index = int(choice) - 1
                 if 0 <= publisher_index < len(publishers):
-                    publisher_path = os.path.join(root_dir, publishers[publisher_index])
+                    publisher_path = publishers[publisher_index].path
+                    if not get_library(root_dir).is_available(publisher_path):
+                        print("This publisher's volume did not respond; try again once it is back.")
+                        input("Press Enter to continue...")
+                        continue
+                    topic_page = 0
                     while True:
                         clear_screen()
-                        topics = display_topics(publisher_path)
-                        topic_choice = input("\nEnter the number, 'back', 'edit', 'open' : ").strip()
+                        topics = display_topics(publisher_path, topic_page)
+                        topic_choice = input("\nEnter the number, 'back', 'edit', 'open', 'retag' : ").strip()
+                        new_page = navigate(topic_choice, topic_page, len(topics))
+                        if new_page is not None:
+                            topic_page = new_page
+                            continue
                         
                         if topic_choice.lower() == 'back':
                             break
+                        elif topic_choice.lower() == 'retag':
+                            bulk_retag([os.path.join(publisher_path, topic) for topic in topics])
+                            continue
                         elif topic_choice.lower() == 'open':
                             open_directory(publisher_path)
                             input("Press Enter to return to the publisher selection...")
@@ -298,10 +343,15 @@ def menu(root_dir):
                             topic_index = int(topic_choice) - 1
                             if 0 <= topic_index < len(topics):
                                 topic_path = os.path.join(publisher_path, topics[topic_index])
+                                chapter_page = 0
                                 while True:
                                     clear_screen()
-                                    chapters = display_chapters(topic_path)
+                                    chapters = display_chapters(topic_path, chapter_page)
                                     chapter_choice = input("\nEnter the number, 'open', 'edit', 'back' : ").strip()
+                                    new_page = navigate(chapter_choice, chapter_page, len(chapters))
+                                    if new_page is not None:
+                                        chapter_page = new_page
+                                        continue
                                     
                                     if chapter_choice.lower() == 'back':
                                         break
@@ -335,13 +385,9 @@ def menu(root_dir):
                 input("Press Enter to continue...")
 
 if __name__ == "__main__":
-    csv_file = 'address.csv'  # Path to your CSV file
     try:
-        target_dir_name = get_directory_name_from_csv(csv_file)
-        root_dir = find_root_directory(os.getcwd(), target_dir_name)
-        menu(root_dir)
+        menu(resolve_library_root())
     except FileNotFoundError as e:
         print(e)
     except ValueError as e:
         print(e)
-
@@ -0,0 +1,61 @@
+import os
+
+'''
+----------------------------
+Paginated lists
+-----------------------------
+
+The menus only render one page of a long publisher, topic or chapter list,
+so per-row work such as counting the files of a chapter is done for the
+visible rows only.  Rows keep their position in the whole list as their
+number, so choosing "57" works the same on every page.
+'''
+
+PAGE_SIZE = int(os.environ.get('VIEWER_PAGE_SIZE', 40))
+
+
+def page_bounds(total, page, page_size=PAGE_SIZE):
+    """
+    Clamp a page number and get the slice of rows it shows.
+
+    Returns:
+        tuple: (page, start, stop) with rows[start:stop] visible.
+    """
+    pages = max(1, -(-total // page_size))
+    page = min(max(page, 0), pages - 1)
+    start = page * page_size
+    return page, start, min(start + page_size, total)
+
+
+def is_page_command(command):
+    """Tell whether user input is a page navigation command."""
+    words = (command or '').strip().lower().split()
+    if len(words) == 1:
+        return words[0] in ('next', 'prev', 'first', 'last')
+    return len(words) == 2 and words[0] == 'page' and words[1].isdigit()
+
+
+def navigate(command, page, total, page_size=PAGE_SIZE):
+    """
+    Apply a navigation command ('next', 'prev', 'first', 'last', 'page N').
+
+    Returns:
+        int: The new page, or None when command is not a navigation command.
+    """
+    if not is_page_command(command):
+        return None
+    words = command.strip().lower().split()
+    last = page_bounds(total, total, page_size)[0]
+    target = {'next': page + 1, 'prev': page - 1, 'first': 0, 'last': last}.get(words[0])
+    if target is None:
+        target = int(words[1]) - 1
+    return page_bounds(total, target, page_size)[0]
+
+
+def print_page_footer(page, total, page_size=PAGE_SIZE):
+    """Print where the visible page is in the list, if there is more than one page."""
+    page, start, stop = page_bounds(total, page, page_size)
+    pages = max(1, -(-total // page_size))
+    if pages > 1:
+        print(f"\nPage {page + 1}/{pages} (items {start + 1}-{stop} of {total}) "
+              "- 'next', 'prev', 'first', 'last', 'page N'")
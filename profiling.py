@@ -0,0 +1,149 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+'''
+----------------------------
+Opt-in hot path instrumentation
+-----------------------------
+
+Set VIEWER_PROFILE=trace.json (or start main.py with --profile trace.json)
+to count and time directory listings, stat calls, file opens and matcher
+calls.  Every call is attributed to the screen being rendered at the time.
+
+On exit two files are written:
+
+    trace.json               Chrome trace events (open in chrome://tracing
+                             or https://ui.perfetto.dev)
+    trace.json.summary.json  per screen render: wall time, and the count and
+                             total time of each kind of call
+
+When profiling is off the wrappers only cost one extra function call.
+'''
+
+PROFILE_ENV = 'VIEWER_PROFILE'
+
+_profiler = None
+
+
+class Profiler:
+    """Collects trace events and per-screen counters; safe to use from worker threads."""
+
+    def __init__(self, trace_file):
+        self.trace_file = trace_file
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.events = []
+        self.screens = []
+        self.current = None
+
+    def _micros(self, seconds):
+        return (seconds - self.origin) * 1e6
+
+    def record(self, category, name, start, end):
+        """Store one completed call."""
+        event = {'name': name, 'cat': category, 'ph': 'X', 'ts': self._micros(start),
+                 'dur': (end - start) * 1e6, 'pid': os.getpid(), 'tid': threading.get_ident()}
+        with self.lock:
+            self.events.append(event)
+            if self.current is not None and category != 'screen':
+                counts, seconds = self.current['calls'], self.current['seconds']
+                counts[category] = counts.get(category, 0) + 1
+                seconds[category] = seconds.get(category, 0.0) + end - start
+
+    def count(self, category):
+        """Count an event without timing it, such as a cache hit."""
+        with self.lock:
+            if self.current is not None:
+                counts = self.current['calls']
+                counts[category] = counts.get(category, 0) + 1
+
+    @contextmanager
+    def screen(self, name):
+        """Attribute everything recorded inside the block to one screen render."""
+        summary = {'screen': name, 'calls': {}, 'seconds': {}}
+        previous, self.current = self.current, summary
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.current = previous
+            summary['render_seconds'] = end - start
+            self.record('screen', name, start, end)
+            with self.lock:
+                self.screens.append(summary)
+
+    def write(self):
+        """Write the Chrome trace and the per-screen summary."""
+        with self.lock:
+            events, screens = list(self.events), list(self.screens)
+        with open(self.trace_file, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+        with open(f"{self.trace_file}.summary.json", 'w') as file:
+            json.dump(screens, file, indent=2)
+
+
+def enable(trace_file):
+    """Turn profiling on and write the results to trace_file when the process exits."""
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler(trace_file)
+        atexit.register(_profiler.write)
+    return _profiler
+
+
+def enabled():
+    """Tell whether profiling is on."""
+    return _profiler is not None
+
+
+def traced(category, function, name=None):
+    """Wrap function so that each call is counted and timed under category when profiling."""
+    label = name or getattr(function, '__qualname__', category)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profiler = _profiler
+        if profiler is None:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.record(category, label, start, time.perf_counter())
+    return wrapper
+
+
+def count(category):
+    """Count one event under category for the current screen when profiling."""
+    profiler = _profiler
+    if profiler is not None:
+        profiler.count(category)
+
+
+def trace(category):
+    """Decorator form of traced."""
+    return lambda function: traced(category, function)
+
+
+def screen(name):
+    """Decorator attributing the calls made while rendering a screen to that screen."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profiler = _profiler
+            if profiler is None:
+                return function(*args, **kwargs)
+            with profiler.screen(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+if os.environ.get(PROFILE_ENV):
+    enable(os.environ[PROFILE_ENV])
@@ -0,0 +1,415 @@
+import bisect
+import heapq
+import os
+import re
+from array import array
+from collections import OrderedDict
+from itertools import islice
+
+from catalog import PUBLISHER_PREFIXES
+from compactcatalog import get_compact_catalog
+from fuzzy import bounded_levenshtein
+from profiling import trace
+from snapshot import SNAPSHOT_FILE
+
+'''
+----------------------------
+Ranked search over every level
+-----------------------------
+
+One query is matched against the names of all publishers, topics and
+chapters at once, and the results are ranked
+
+    exact > prefix > word start > substring > fuzzy
+
+Within a kind shorter names rank first, then publishers before topics before
+chapters.  The index is built from a CompactCatalog.  Its distinct names are
+lower-cased and laid out one per line in a single string, sorted by (length,
+name), so that every kind is answered by str.find passes over one buffer
+that already meet the names in rank order; the scan stops as soon as enough
+results were found.  The word starts of every name are laid out the same
+way in a second buffer, which makes word start matching a prefix search.
+Queries of one or two characters are therefore as cheap as longer ones.
+
+Fuzzy matches are only looked for when the other kinds leave room: names
+containing the query's letters in order ("qm" for "Quantum Mechanics"), and
+for longer queries words within a small edit distance of it ("phisics").
+The fuzzy candidates are scored and the best ones picked with a heap, and
+the results of several roots are merged lazily with heapq.merge.
+
+SearchSession serves search-as-you-type: it caches recent queries and
+narrows the previous query's matches when a character is appended.
+'''
+
+EXACT, PREFIX, WORD, SUBSTRING, FUZZY = 4, 3, 2, 1, 0
+KIND_NAMES = {EXACT: 'exact', PREFIX: 'prefix', WORD: 'word', SUBSTRING: 'substring', FUZZY: 'fuzzy'}
+LEVELS = ('publisher', 'topic', 'chapter')
+
+# How many candidate names each fuzzy pass scores before picking the best ones.
+FUZZY_SCAN = 200
+# Longest query still tried as an abbreviation (its letters in order).
+ABBREVIATION_LENGTH = 5
+# Minimum similarity (0-1) of a fuzzy match.
+FUZZY_CUTOFF = 0.5
+
+RANKED_LIMIT = 50
+
+# Most names a SearchSession keeps as the candidates of one query.
+CANDIDATE_LIMIT = 2000
+# Queries whose results a SearchSession remembers.
+QUERY_CACHE_SIZE = 64
+
+
+def normalize_query(query):
+    """Get the form a query is matched and cached by."""
+    return query.strip().lower().replace('\n', ' ')
+
+
+def _kind(line, query):
+    """Get how a name containing query matches it: EXACT, PREFIX, WORD or SUBSTRING."""
+    if line == query:
+        return EXACT
+    if line.startswith(query):
+        return PREFIX
+    found = line.find(query, 1)
+    while found != -1:
+        if line[found].isalnum() and not line[found - 1].isalnum():
+            return WORD
+        found = line.find(query, found + 1)
+    return SUBSTRING
+
+
+def _word_starts(key):
+    """Get the positions after the first character where a word begins."""
+    return [i for i in range(1, len(key)) if key[i].isalnum() and not key[i - 1].isalnum()]
+
+
+class RankedIndex:
+    """Name index over the publishers, topics and chapters of one CompactCatalog."""
+
+    def __init__(self, compact, prefixes=PUBLISHER_PREFIXES):
+        self.compact = compact
+        publishers = [node_id for node_id in compact.child_ids(0)
+                      if compact.name(node_id).startswith(tuple(prefixes))]
+        topics = [child for node_id in publishers for child in compact.child_ids(node_id)]
+        chapters = [child for node_id in topics for child in compact.child_ids(node_id)]
+        # Ids are breadth first, so every topic id lies between these bounds.
+        self.level_starts = (topics[0] if topics else len(compact),
+                             chapters[0] if chapters else len(compact))
+
+        name_ids = compact.name_ids
+        nodes = sorted(publishers + topics + chapters, key=name_ids.__getitem__)
+        keys = {}
+        for node_id in nodes:
+            name_id = name_ids[node_id]
+            if name_id not in keys:
+                keys[name_id] = compact.name(node_id).lower().replace('\n', ' ')
+        order = sorted(keys, key=lambda name_id: (len(keys[name_id]), keys[name_id], name_id))
+        position_of = {name_id: position for position, name_id in enumerate(order)}
+
+        # entries[starts[p]:starts[p + 1]] are the node ids named like line p, in id order.
+        nodes.sort(key=lambda node_id: position_of[name_ids[node_id]])
+        self.entries = array('I', nodes)
+        self.starts = array('I', [0] * (len(order) + 1))
+        for node_id in nodes:
+            self.starts[position_of[name_ids[node_id]] + 1] += 1
+        for position in range(len(order)):
+            self.starts[position + 1] += self.starts[position]
+
+        lines = [keys[name_id] for name_id in order]
+        self.names, self.offsets = self._layout(lines)
+        # Where the names of each length begin, to bound exact and prefix scans.
+        self.length_starts = array('q')
+        for position, line in enumerate(lines):
+            while len(self.length_starts) <= len(line):
+                self.length_starts.append(self.offsets[position])
+        self.length_starts.append(len(self.names))
+
+        words, self.word_owners = [], array('I')
+        for position, line in enumerate(lines):
+            for start in _word_starts(line):
+                words.append(line[start:])
+                self.word_owners.append(position)
+        self.words, self.word_offsets = self._layout(words)
+
+    @staticmethod
+    def _layout(lines):
+        """Join lines into '\\n' + line + '\\n' + ... and get the offset of every line."""
+        offsets = array('q')
+        offset = 1
+        for line in lines:
+            offsets.append(offset)
+            offset += len(line) + 1
+        return '\n' + ''.join(line + '\n' for line in lines), offsets
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _length_start(self, length):
+        return self.length_starts[min(length, len(self.length_starts) - 1)]
+
+    def _lines(self, buffer, offsets, needle, start=0, stop=None):
+        """Yield the line numbers where needle occurs, each line once, in buffer order."""
+        stop = len(buffer) if stop is None else stop
+        # A needle starting with '\n' is found at the end of the previous line.
+        skip = needle.startswith('\n')
+        found = buffer.find(needle, start, stop)
+        while found != -1:
+            yield bisect.bisect_right(offsets, found + skip) - 1
+            found = buffer.find(needle, buffer.index('\n', found + 1), stop)
+
+    def _matches(self, query):
+        """Yield (kind, name position) for the exact to substring matches, best first."""
+        seen = set()
+        length = len(query)
+        exact = self._lines(self.names, self.offsets, f"\n{query}\n",
+                            self._length_start(length) - 1, self._length_start(length + 1))
+        prefix = self._lines(self.names, self.offsets, f"\n{query}", self._length_start(length) - 1)
+        words = (self.word_owners[line] for line in
+                 self._lines(self.words, self.word_offsets, f"\n{query}"))
+        substring = self._lines(self.names, self.offsets, query, self._length_start(length))
+        for kind, positions in ((EXACT, exact), (PREFIX, prefix), (WORD, words),
+                                (SUBSTRING, substring)):
+            for position in positions:
+                if position not in seen:
+                    seen.add(position)
+                    yield kind, position
+
+    def _fuzzy(self, query, exclude, limit):
+        """Get the best (similarity, position) fuzzy matches not in exclude."""
+        scored = {}
+        abbreviation = re.compile('[^\n]*?'.join(re.escape(char) for char in query))
+        if len(query) > ABBREVIATION_LENGTH or ' ' in query:
+            abbreviation = None
+        for found in islice(abbreviation.finditer(self.names) if abbreviation else (), FUZZY_SCAN):
+            position = bisect.bisect_right(self.offsets, found.start()) - 1
+            if position not in exclude:
+                similarity = len(query) / (found.end() - found.start())
+                scored[position] = max(similarity * 0.9, scored.get(position, 0))
+        if len(query) >= 4:
+            max_distance = max(1, len(query) // 4)
+            half = len(query) // 2
+            for part in (query[:half], query[half:]):
+                for position in islice(self._lines(self.names, self.offsets, part), FUZZY_SCAN):
+                    if position in exclude or position in scored:
+                        continue
+                    line = self._line(position)
+                    distance = min(bounded_levenshtein(query, word, max_distance)
+                                   for word in line.split() or [line])
+                    if distance <= max_distance:
+                        scored[position] = 1 - distance / len(query)
+        best = heapq.nsmallest(limit, ((-similarity, position)
+                                       for position, similarity in scored.items()
+                                       if similarity >= FUZZY_CUTOFF))
+        return [(-negative, position) for negative, position in best]
+
+    def _line(self, position):
+        start = self.offsets[position]
+        return self.names[start:self.names.index('\n', start)]
+
+    def candidates(self, query, limit=CANDIDATE_LIMIT):
+        """
+        Get the positions of every name containing a normalized query.
+
+        Returns:
+            array: The positions in rank order, or None if there are more than limit.
+        """
+        start = self._length_start(len(query))
+        # Counting in C first avoids collecting positions only to give up.
+        if self.names.count(query, start) > limit:
+            return None
+        return array('I', self._lines(self.names, self.offsets, query, start))
+
+    def narrow(self, query, positions):
+        """Get the positions of the names containing query among those of a shorter query."""
+        return array('I', [position for position in positions if query in self._line(position)])
+
+    def _ranked_candidates(self, query, positions, limit):
+        """Yield (kind, position) for the best of some candidates, like _matches."""
+        ranked = heapq.nsmallest(limit, ((-_kind(self._line(position), query), position)
+                                         for position in positions))
+        for negative_kind, position in ranked:
+            yield -negative_kind, position
+
+    def ranked(self, query, limit=RANKED_LIMIT, positions=None):
+        """
+        Yield (sort key, node id) of the best matches of query, best first.
+
+        The sort keys order results across indexes too, see search_indexes.
+
+        Args:
+            positions (array): Every name position containing the query, as
+                candidates or narrow return them, to rank instead of scanning.
+        """
+        query = normalize_query(query)
+        if not query or limit <= 0:
+            return
+        found = 0
+        seen = set()
+        matches = self._matches(query) if positions is None else \
+            self._ranked_candidates(query, positions, limit)
+        for kind, position in matches:
+            seen.add(position)
+            for key in self._keys(-kind, 0.0, position):
+                yield key
+                found += 1
+                if found >= limit:
+                    return
+        for similarity, position in self._fuzzy(query, seen, limit - found):
+            for key in self._keys(-FUZZY, -similarity, position):
+                yield key
+                found += 1
+                if found >= limit:
+                    return
+
+    def _keys(self, negative_kind, negative_similarity, position):
+        line = self._line(position)
+        for node_id in self.entries[self.starts[position]:self.starts[position + 1]]:
+            yield (negative_kind, negative_similarity, len(line), line, node_id), node_id
+
+    def level(self, node_id):
+        """Get 'publisher', 'topic' or 'chapter' for an indexed node."""
+        return LEVELS[bisect.bisect_right(self.level_starts, node_id)]
+
+    def record(self, node_id, kind):
+        """Describe one match as a dict."""
+        path = self.compact.path(node_id)
+        parts = os.path.relpath(path, self.compact.root_dir).split(os.sep)
+        return {
+            'level': self.level(node_id),
+            'match': KIND_NAMES[kind],
+            'name': parts[-1],
+            'publisher': parts[0],
+            'topic': parts[1] if len(parts) > 1 else None,
+            'chapter': parts[2] if len(parts) > 2 else None,
+            'path': path,
+        }
+
+    @trace('search')
+    def search(self, query, limit=RANKED_LIMIT):
+        """
+        Find the best publishers, topics and chapters for a query.
+
+        Returns:
+            list: Up to limit result dicts (see record), best first.
+        """
+        return search_indexes([self], query, limit)
+
+
+def search_indexes(indexes, query, limit=RANKED_LIMIT, candidates=None):
+    """
+    Merge the ranked results of several indexes (one per library root), best first.
+
+    Args:
+        candidates (list): Per index, the positions to rank (see
+            RankedIndex.ranked) or None to scan that index.
+    """
+    candidates = candidates or [None] * len(indexes)
+
+    def stream(order, index):
+        for key, node_id in index.ranked(query, limit, candidates[order]):
+            # Equal names rank by root order first, node ids only order one root.
+            yield (key[:-1], order, node_id), index, node_id
+
+    streams = [stream(order, index) for order, index in enumerate(indexes)]
+    merged = heapq.merge(*streams, key=lambda item: item[0])
+    return [index.record(node_id, -key[0][0]) for key, index, node_id in islice(merged, limit)]
+
+
+class SearchSession:
+    """
+    Repeated searches of the same indexes while a query is being typed.
+
+    The results of recent queries are kept in an LRU cache, so deleting a
+    character shows the previous results again at once.  For a query with
+    at most CANDIDATE_LIMIT matching names the names are kept too; a longer
+    query extending it only checks those names instead of scanning the
+    indexes, since every name containing the longer query contains the
+    shorter one.
+    """
+
+    def __init__(self, indexes, limit=RANKED_LIMIT, cache_size=QUERY_CACHE_SIZE):
+        """
+        Args:
+            indexes (list): The RankedIndex of every root, or a function
+                returning them, called on the first search.
+        """
+        self._indexes = indexes if callable(indexes) else list(indexes)
+        self.limit = limit
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # query -> (results, candidate positions per index)
+        self.hits = 0
+        self.misses = 0
+        self.narrowed = 0
+
+    @property
+    def loaded(self):
+        """Tell whether the indexes were already built."""
+        return not callable(self._indexes)
+
+    @property
+    def indexes(self):
+        if not self.loaded:
+            self._indexes = list(self._indexes())
+        return self._indexes
+
+    def _base(self, query):
+        """Get the candidates of the longest cached query that query extends."""
+        for length in range(len(query) - 1, 0, -1):
+            cached = self.cache.get(query[:length])
+            if cached is not None and any(positions is not None for positions in cached[1]):
+                return cached[1]
+        return None
+
+    @trace('search')
+    def search(self, query):
+        """Get the ranked results of query (see search_indexes), reusing earlier queries."""
+        query = normalize_query(query)
+        cached = self.cache.get(query)
+        if cached is not None:
+            self.cache.move_to_end(query)
+            self.hits += 1
+            return cached[0]
+        self.misses += 1
+        base = self._base(query) or [None] * len(self.indexes)
+        candidates = []
+        for index, positions in zip(self.indexes, base):
+            if positions is not None:
+                self.narrowed += 1
+                candidates.append(index.narrow(query, positions))
+            else:
+                candidates.append(index.candidates(query) if query else None)
+        results = search_indexes(self.indexes, query, self.limit, candidates)
+        self.cache[query] = (results, candidates)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return results
+
+    def stats(self):
+        """Get the cache hit/miss counts, for tuning."""
+        return {'hits': self.hits, 'misses': self.misses, 'narrowed': self.narrowed,
+                'cached_queries': len(self.cache)}
+
+
+_indexes = {}
+
+
+def get_ranked_index(root_dir, refresh=True, snapshot_file=SNAPSHOT_FILE, rescan_first=True):
+    """
+    Get the ranked index of root_dir, rebuilt only when its compact catalog was.
+
+    Args:
+        refresh (bool): Rescan the library first (see get_compact_catalog).
+        rescan_first (bool): See get_compact_catalog.
+    """
+    root_dir = os.path.abspath(root_dir)
+    compact = get_compact_catalog(root_dir, refresh, snapshot_file, rescan_first)
+    index = _indexes.get(root_dir)
+    if index is None or index.compact is not compact:
+        index = _indexes[root_dir] = RankedIndex(compact)
+    return index
+
+
+def clear_ranked_indexes():
+    """Forget the ranked indexes held in memory."""
+    _indexes.clear()
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import csv
+import pickle
+import sys
+
+CSV_FILE = 'address.csv'  # Path to your CSV file
+
+'''
+----------------------------
+Cached root resolution
+-----------------------------
+
+Finding a root by name probes every ancestor of the cwd, and on automounted
+paths each probe can trigger a mount attempt.  resolve_root_directories
+therefore remembers, for each name in the CSV file, the root it was found
+at (or that it was not found) in ROOT_CACHE_FILE, keyed on the cwd and on
+the CSV file's path, mtime, size and content hash.  A later start only
+stats the CSV file and each remembered root: roots that are still
+directories are used without any searching, and only names whose root has
+gone or was never found are searched for again, so a volume that was
+missing on one start is picked up on the next.  A root given as an absolute
+path in the CSV file is not even stat'ed.
+'''
+
+ROOT_CACHE_FILE = 'root_cache.pickle'
+ROOT_CACHE_VERSION = 2
+
+
+def get_directory_names_from_csv(csv_file):
+    """
+    Get the directory names from the first column of every row of the CSV file.
+
+    Args:
+        csv_file (str): Path to the CSV file.
+
+    Returns:
+        list: The directory names, in file order.
+    """
+    try:
+        with open(csv_file, mode='r') as file:
+            names = [row[0].strip() for row in csv.reader(file) if row and row[0].strip()]
+    except Exception as e:
+        print(f"Error reading CSV file: {e}")
+        raise
+    if not names:
+        raise ValueError("CSV file is empty or has no valid rows.")
+    return names
+
+def find_root_directory(start_dir, target_dir_name):
+    """Find the target directory starting from the start_dir and moving up through parent directories."""
+    current_dir = os.path.abspath(start_dir)
+    while True:
+        potential_root = os.path.join(current_dir, target_dir_name)
+        if os.path.isdir(potential_root):
+            return potential_root
+        parent_dir = os.path.dirname(current_dir)
+        if parent_dir == current_dir:
+            break
+        current_dir = parent_dir
+    raise FileNotFoundError(f"Directory '{target_dir_name}' not found.")
+
+
+def _resolve(resolved, start_dir):
+    """
+    Find the roots of (name, remembered root) pairs, searching only where needed.
+
+    Absolute paths are used as they are, without touching them, so that an
+    offline volume cannot stall startup; a remembered root is kept while it is
+    still a directory, and other names are searched for upwards from start_dir
+    and skipped with a warning if not found.
+
+    Returns:
+        list: (name, root or None) pairs, in the order of resolved.
+    """
+    result = []
+    for name, root in resolved:
+        if os.path.isabs(name):
+            result.append((name, name))
+            continue
+        if root is not None and os.path.isdir(root):
+            result.append((name, root))
+            continue
+        try:
+            root = find_root_directory(start_dir, name)
+        except FileNotFoundError as e:
+            print(f"Warning: {e}", file=sys.stderr)
+            root = None
+        result.append((name, root))
+    return result
+
+
+def _load_root_cache(cache_file):
+    try:
+        with open(cache_file, 'rb') as file:
+            version, entries = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError):
+        return {}
+    return entries if version == ROOT_CACHE_VERSION else {}
+
+
+def _save_root_cache(cache_file, entries):
+    temp_file = f"{cache_file}.tmp"
+    try:
+        with open(temp_file, 'wb') as file:
+            pickle.dump((ROOT_CACHE_VERSION, entries), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        pass    # A read-only directory only costs the search on the next start.
+
+
+def resolve_root_directories(csv_file=CSV_FILE, start_dir=None, cache_file=ROOT_CACHE_FILE):
+    """
+    Find every library root listed in csv_file, reusing the roots found last time.
+
+    Args:
+        csv_file (str): Path to the CSV file listing the roots.
+        start_dir (str): Directory to search upwards from, the cwd by default.
+        cache_file (str): File remembering resolved roots, None to always search.
+
+    Returns:
+        list: The root directories, the primary one first.
+    """
+    start_dir = os.path.abspath(start_dir or os.getcwd())
+    csv_path = os.path.abspath(csv_file)
+    stat = os.stat(csv_path)
+    csv_key = (stat.st_mtime_ns, stat.st_size)
+    entries = _load_root_cache(cache_file) if cache_file else {}
+    cached = entries.get((start_dir, csv_path))
+    if cached and cached['csv_key'] == csv_key:
+        digest, remembered = cached['digest'], cached['resolved']
+    else:
+        try:
+            with open(csv_path, 'rb') as file:
+                digest = hashlib.sha1(file.read()).hexdigest()
+        except Exception as e:
+            print(f"Error reading CSV file: {e}")
+            raise
+        if cached and cached['digest'] == digest:
+            remembered = cached['resolved']
+        else:
+            remembered = [(name, None) for name in get_directory_names_from_csv(csv_path)]
+
+    resolved = _resolve(remembered, start_dir)
+    if cache_file and (resolved != remembered or not cached or cached['csv_key'] != csv_key):
+        entries[(start_dir, csv_path)] = {'csv_key': csv_key, 'digest': digest,
+                                          'resolved': resolved}
+        _save_root_cache(cache_file, entries)
+    roots = [root for _, root in resolved if root is not None]
+    if not roots:
+        raise FileNotFoundError("None of the directories in the CSV file were found.")
+    return roots
@@ -0,0 +1,37 @@
+from catalog import DirChanges, get_catalog
+
+'''
+----------------------------
+Incremental rescan of the library
+-----------------------------
+
+Instead of an os.walk over the whole tree, the rescan walks the directories
+already recorded in the catalog.  Every directory costs one stat; only the
+ones whose mtime or inode changed are listed again, and new directories are
+listed for the first time.  The result is the list of entries that were
+added, removed or renamed since the previous scan.
+
+The walk itself (Catalog.split_rescan) only reads what it needs from the
+database up front, so the library can run it on a root's own worker and
+store the result afterwards.
+'''
+
+
+def rescan(root_dir, catalog=None):
+    """
+    Bring the catalog of root_dir up to date with the disk.
+
+    Args:
+        root_dir (str): Directory to rescan, usually the library root.
+        catalog (Catalog): Catalog to update, the shared one by default.
+
+    Returns:
+        DirChanges: Directories added, removed and renamed (old, new) below root_dir.
+    """
+    catalog = catalog or get_catalog()
+    probe, store = catalog.split_rescan(root_dir)
+    try:
+        found = probe()
+    except (FileNotFoundError, NotADirectoryError):
+        return DirChanges([], [], [])
+    return store(found)
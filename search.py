@@ -1,99 +1,228 @@
 import os
 import subprocess
 import sys
-import csv
 
+from chapters import chapters_screen
+from fileindex import FILE_INDEX_FILE, get_file_index, split_file_index
+from library import get_library, resolve_library_root
+from topicindex import TOPIC_INDEX_FILE, get_topic_index
+from pager import PAGE_SIZE, navigate, page_bounds, print_page_footer
+from profiling import screen
+from ranksearch import LEVELS, RANKED_LIMIT, SearchSession, get_ranked_index, search_indexes
+from snapshot import SNAPSHOT_FILE
+from terminal import BACKSPACE, ENTER, ESCAPE, is_interactive, raw_mode, read_key, redraw
 
-# ----------------------------------------------
-def get_directory_name_from_csv(csv_file):
-    """
-    Get the directory name from the first row of the CSV file.
-    
-    Args:
-        csv_file (str): Path to the CSV file.
-    
-    Returns:
-        str: The directory name from the first row.
-    """
-    try:
-        with open(csv_file, mode='r') as file:
-            reader = csv.reader(file)
-            first_row = next(reader, None)
-            if first_row and first_row[0]:
-                return first_row[0]
-            else:
-                raise ValueError("CSV file is empty or has no valid rows.")
-    except Exception as e:
-        print(f"Error reading CSV file: {e}")
-        raise
-
-def find_root_directory(start_dir, target_dir_name):
-    """Find the target directory starting from the start_dir and moving up through parent directories."""
-    current_dir = os.path.abspath(start_dir)
-    while True:
-        potential_root = os.path.join(current_dir, target_dir_name)
-        if os.path.isdir(potential_root):
-            return potential_root
-        parent_dir = os.path.dirname(current_dir)
-        if parent_dir == current_dir:
-            break
-        current_dir = parent_dir
-    raise FileNotFoundError(f"Directory '{target_dir_name}' not found.")
-    
-#----------------------------------------------    
-
-
-def get_publishers(root_dir):
-    """Get a list of publishers."""
-    return sorted([d for d in os.listdir(root_dir) if os.path.isdir(os.path.join(root_dir, d)) and d.startswith('__')])
-
-def get_topics(publisher_path):
-    """Get a list of topics under a publisher."""
-    return sorted([d for d in os.listdir(publisher_path) if os.path.isdir(os.path.join(publisher_path, d))])
-
-def get_chapters(topic_path):
-    """Get a list of chapters under a topic."""
-    return sorted([d for d in os.listdir(topic_path) if os.path.isdir(os.path.join(topic_path, d))])
-
-def count_files(chapter_path):
-    """Count files in a chapter."""
-    return len([f for f in os.listdir(chapter_path) if os.path.isfile(os.path.join(chapter_path, f))])
-
-def display_topics(topics):
-    """Display the list of topics."""
-    print("\nAvailable Topics:")
-    for index, topic in enumerate(topics):
-        print(f"{index + 1}. {topic}")
-    return topics
-
-def display_chapters(topic_path):
-    """Display the list of chapters under a selected topic."""
-    chapters = get_chapters(topic_path)
-    print("\nAvailable Chapters:")
-    for index, chapter in enumerate(chapters):
-        file_count = count_files(os.path.join(topic_path, chapter))
-        print(f"{index + 1}. [{file_count} Files] - {chapter}")
-    return chapters
+
+# Shortest query whose topic matches are streamed while the indexes are built.
+STREAM_MIN = 3
+
+display_chapters = chapters_screen('search.display_chapters')
 
 def clear_screen():
     """Clear the terminal screen."""
     os.system('cls' if os.name == 'nt' else 'clear')
 
+@screen('search.search_topics')
 def search_topics(root_dir, search_query):
-    """Search for topics across all publishers that match the search query with at least 3 characters."""
-    search_query = search_query.lower()
+    """Search for topics across all publishers of every library root that match the search query with at least 3 characters."""
+    if len(search_query) < 3:
+        return []
+    library = get_library(root_dir)
     matched_topics = []
-    publishers = get_publishers(root_dir)
-    
-    for publisher in publishers:
-        publisher_path = os.path.join(root_dir, publisher)
-        topics = get_topics(publisher_path)
-        for topic in topics:
-            if search_query in topic.lower() and len(search_query) >= 3:
-                matched_topics.append((topic, publisher_path))
-    
+    for root in library.rescan(depth=1):
+        index = get_topic_index(root, prefixes=('__',), refresh=False,
+                                index_file=library.cache_file(TOPIC_INDEX_FILE, root))
+        matched_topics.extend((topic, os.path.join(root, publisher))
+                              for publisher, topic in index.search(search_query))
     return sorted(matched_topics)
 
+def stream_search_topics(root_dir, search_query):
+    """
+    Yield (topic, publisher_path) pairs of every publisher, validating only the publishers.
+
+    This is much quicker than the full rescan the ranked indexes need, so
+    these matches can be shown while that runs.
+    """
+    library = get_library(root_dir)
+    for root in library.rescan(depth=1):
+        index = get_topic_index(root, refresh=False, index_file=library.cache_file(TOPIC_INDEX_FILE, root))
+        for publisher, topic in index.search(search_query):
+            yield topic, os.path.join(root, publisher)
+
+@screen('search.preview_topics')
+def preview_topics(root_dir, search_query, limit=PAGE_SIZE):
+    """Show matching topics publisher by publisher while the library is indexed for the first query."""
+    print("\nIndexing the library... matching topics so far:", flush=True)
+    shown = 0
+    for topic, publisher_path in stream_search_topics(root_dir, search_query):
+        print(f"- {topic} - {os.path.basename(publisher_path)}", flush=True)
+        shown += 1
+        if shown >= limit:
+            break
+
+@screen('search.ranked_search')
+def ranked_search(root_dir, search_query, limit=RANKED_LIMIT, refresh=True):
+    """
+    Rank the publishers, topics and chapters of every library root against a query of any length.
+
+    Args:
+        refresh (bool): Rescan the roots first; without it the last snapshot is searched.
+    """
+    return search_indexes(ranked_indexes(root_dir, refresh), search_query, limit)
+
+def ranked_indexes(root_dir, refresh=True):
+    """Get the ranked index of every library root that answered, rescanning each on its own worker."""
+    library = get_library(root_dir)
+    roots = library.rescan() if refresh else library.refresh()
+    return [get_ranked_index(root, refresh, library.cache_file(SNAPSHOT_FILE, root), rescan_first=False)
+            for root in roots]
+
+def print_matches(matches, start, stop):
+    """Print matches[start:stop], numbered by their position in matches."""
+    for index in range(start, min(stop, len(matches))):
+        found = matches[index]
+        location = ' / '.join((found['publisher'], found['topic'])[:LEVELS.index(found['level'])])
+        print(f"{index + 1}. [{found['level'].title()}] {found['name']}" + (f" - {location}" if location else ""))
+
+def first_search(session, root_dir, search_query):
+    """
+    Search through a session, streaming topic matches first if its indexes are not built yet.
+
+    Building the indexes rescans every root, so on the first query the
+    topics matching it are shown publisher by publisher in the meantime
+    instead of a blank screen.
+    """
+    if not session.loaded and len(search_query) >= STREAM_MIN:
+        preview_topics(root_dir, search_query)
+    elif not session.loaded:
+        print("\nIndexing the library...", flush=True)
+    return session.search(search_query)
+
+def live_search(session, prompt, root_dir):
+    """
+    Read a query key by key, showing the best matches after every key press.
+
+    Until the indexes are built, queries shorter than STREAM_MIN characters
+    wait for more keys, and the first longer one streams its topic matches
+    while the indexes are built.
+
+    Returns:
+        str: The query when Enter is pressed, 'exit' when Escape is.
+    """
+    query = ''
+    with raw_mode():
+        while True:
+            redraw()
+            print(f"\n{prompt}\n> {query}")
+            if query and not session.loaded:
+                if len(query) < STREAM_MIN:
+                    print(f"\nType at least {STREAM_MIN} characters to start searching.")
+                else:
+                    first_search(session, root_dir, query)
+                    continue    # Redraw with the ranked matches.
+            elif query:
+                matches = session.search(query)
+                print("\nBest Matches:" if matches else "\nNothing found.")
+                print_matches(matches, 0, PAGE_SIZE)
+            sys.stdout.flush()
+            key = read_key()
+            if key == ENTER:
+                return query
+            elif key == ESCAPE:
+                return 'exit'
+            elif key == BACKSPACE:
+                query = query[:-1]
+            elif key is not None:
+                query += key
+
+@screen('search.display_matches')
+def display_matches(matches, page=0):
+    """Display one page of ranked search results with where each one is."""
+    page, start, stop = page_bounds(len(matches), page)
+    print("\nBest Matches:")
+    print_matches(matches, start, stop)
+    print_page_footer(page, len(matches))
+    return matches
+
+@screen('search.search_files')
+def search_files(root_dir, search_query, refresh=True):
+    """
+    Search the file names of every library root; glob patterns such as '*.pdf' are allowed.
+
+    Args:
+        refresh (bool): Stat every directory for changes first; without it
+            the indexes as last refreshed are searched.
+    """
+    library = get_library(root_dir)
+    if refresh:
+        indexes = library.run_on_roots('files', lambda root: split_file_index(
+            root, library.cache_file(FILE_INDEX_FILE, root)), library.scan_timeout).values()
+    else:
+        indexes = [get_file_index(root, library.cache_file(FILE_INDEX_FILE, root), refresh=False)
+                   for root in library.available_roots()]
+    return [found for index in indexes for found in index.search(search_query)]
+
+@screen('search.display_files')
+def display_files(files, page=0):
+    """Display one page of file search results with the chapter each file is in."""
+    page, start, stop = page_bounds(len(files), page)
+    print("\nMatching Files:")
+    for index in range(start, stop):
+        found = files[index]
+        location = ' / '.join(part for part in (found['publisher'], found['topic'], found['chapter']) if part)
+        print(f"{index + 1}. {found['file']} ({found['size']} bytes) - {location}")
+    print_page_footer(page, len(files))
+    return files
+
+def files_menu(root_dir):
+    """
+    Search file names and open the chapter directory containing a chosen file.
+
+    The file indexes are brought up to date once when the screen is opened;
+    searching again from it reuses them.
+    """
+    refresh = True
+    while True:
+        search_query = input("\nEnter a file name search (text or a pattern like '*.pdf'): ").strip()
+        if not search_query:
+            return True
+        matched_files = search_files(root_dir, search_query, refresh)
+        refresh = False
+        if not matched_files:
+            print("No files found.")
+            input("Press Enter to search again...")
+            continue
+        if not browse_files(matched_files):
+            return False
+
+def browse_files(matched_files):
+    """Page through file search results; return False when the user chose to exit."""
+    file_page = 0
+    while True:
+        clear_screen()
+        display_files(matched_files, file_page)
+        file_choice = input("\nEnter the number of a file to open its chapter, 'search' to search again, or 'exit' to quit: ").strip()
+        new_page = navigate(file_choice, file_page, len(matched_files))
+        if new_page is not None:
+            file_page = new_page
+            continue
+
+        if file_choice.lower() == 'search':
+            return True
+        elif file_choice.lower() == 'exit':
+            return False
+        try:
+            file_index = int(file_choice) - 1
+            if 0 <= file_index < len(matched_files):
+                chapter_path = matched_files[file_index]['directory']
+                open_directory(chapter_path)
+                print(f"Opened directory: {chapter_path}")
+            else:
+                print("Invalid file number.")
+        except ValueError:
+            print("Invalid input. Please enter a number.")
+        input("Press Enter to continue...")
+
 def open_directory(path):
     """Open the directory in the file explorer."""
     if os.name == 'nt':  # Windows
@@ -101,95 +230,111 @@ def open_directory(path):
     elif os.name == 'posix':  # macOS and Linux
         subprocess.run(['open', path] if sys.platform == 'darwin' else ['xdg-open', path])
 
+def chapters_menu(topic_path):
+    """Browse the chapters of a topic; return False when the user chose to exit."""
+    chapter_page = 0
+    while True:
+        clear_screen()
+        chapters = display_chapters(topic_path, chapter_page)
+        chapter_choice = input("\nEnter the number of the chapter you want to choose, 'open' to open topic directory, or 'back' to go back: ").strip()
+        new_page = navigate(chapter_choice, chapter_page, len(chapters))
+        if new_page is not None:
+            chapter_page = new_page
+            continue
+
+        if chapter_choice.lower() == 'exit':
+            return False
+        elif chapter_choice.lower() == 'open':
+            open_directory(topic_path)
+            print(f"Opened directory: {topic_path}")
+            input("Press Enter to continue...")
+        elif chapter_choice.lower() == 'back':
+            return True
+        else:
+            try:
+                chapter_index = int(chapter_choice) - 1
+                if 0 <= chapter_index < len(chapters):
+                    chapter = chapters[chapter_index]
+                    chapter_path = os.path.join(topic_path, chapter)
+                    open_directory(chapter_path)
+                    print(f"Opened directory: {chapter_path}")
+                    input("Press Enter to continue...")
+                else:
+                    print("Invalid chapter number.")
+                    input("Press Enter to continue...")
+            except ValueError:
+                print("Invalid input. Please enter a number.")
+                input("Press Enter to continue...")
+
 def menu(root_dir):
+    # One session per visit: the library is rescanned on the first query
+    # only, then every query is answered from the indexes and the cache.
+    session = SearchSession(lambda: ranked_indexes(root_dir))
+    prompt = "Enter a search for publishers, topics and chapters, 'files' to search file names, or type 'exit' to quit:"
     while True:
         clear_screen()
-        search_query = input("\nEnter a topic search query (at least 3 characters) or type 'exit' to quit: ").strip()
+        if is_interactive():
+            search_query = live_search(session, prompt, root_dir).strip()
+        else:
+            search_query = input(f"\n{prompt} ").strip()
         
         if search_query.lower() == 'exit':
             break
+
+        if search_query.lower() == 'files':
+            if not files_menu(root_dir):
+                return
+            continue
         
-        if len(search_query) < 3:
-            print("Search query must be at least 3 characters long.")
-            input("Press Enter to continue...")
+        if not search_query:
             continue
         
-        matched_topics = search_topics(root_dir, search_query)
+        matches = first_search(session, root_dir, search_query)
         
-        if not matched_topics:
-            print("No topics found.")
+        if not matches:
+            print("Nothing found.")
             input("Press Enter to search again...")
             continue
         
+        match_page = 0
         while True:
             clear_screen()
-            print("\nMatching Topics:")
-            for index, (topic, _) in enumerate(matched_topics):
-                print(f"{index + 1}. {topic}")
+            display_matches(matches, match_page)
             
-            topic_choice = input("\nEnter the number of the topic you want to choose, 'search' to search again, or 'exit' to quit: ").strip()
+            match_choice = input("\nEnter the number of a topic to see its chapters (or of a publisher or chapter to open it), 'search' to search again, or 'exit' to quit: ").strip()
+            new_page = navigate(match_choice, match_page, len(matches))
+            if new_page is not None:
+                match_page = new_page
+                continue
             
-            if topic_choice.lower() == 'search':
+            if match_choice.lower() == 'search':
                 break
-            elif topic_choice.lower() == 'exit':
+            elif match_choice.lower() == 'exit':
                 return
             else:
                 try:
-                    topic_index = int(topic_choice) - 1
-                    if 0 <= topic_index < len(matched_topics):
-                        topic, publisher_path = matched_topics[topic_index]
-                        topic_path = os.path.join(publisher_path, topic)
-                        
-                        while True:
-                            clear_screen()
-                            chapters = display_chapters(topic_path)
-                            chapter_choice = input("\nEnter the number of the chapter you want to choose, 'open' to open topic directory, or 'back' to go back: ").strip()
-                            
-                            if chapter_choice.lower() == 'exit':
+                    match_index = int(match_choice) - 1
+                    if 0 <= match_index < len(matches):
+                        found = matches[match_index]
+                        if found['level'] == 'topic':
+                            if not chapters_menu(found['path']):
                                 return
-                            elif chapter_choice.lower() == 'open':
-                                open_directory(topic_path)
-                                print(f"Opened directory: {topic_path}")
-                                input("Press Enter to continue...")
-                            elif chapter_choice.lower() == 'back':
-                                break
-                            else:
-                                try:
-                                    chapter_index = int(chapter_choice) - 1
-                                    if 0 <= chapter_index < len(chapters):
-                                        chapter = chapters[chapter_index]
-                                        chapter_path = os.path.join(topic_path, chapter)
-                                        open_directory(chapter_path)
-                                        print(f"Opened directory: {chapter_path}")
-                                        input("Press Enter to continue...")
-                                    else:
-                                        print("Invalid chapter number.")
-                                        input("Press Enter to continue...")
-                                except ValueError:
-                                    print("Invalid input. Please enter a number.")
-                                    input("Press Enter to continue...")
+                        else:
+                            open_directory(found['path'])
+                            print(f"Opened directory: {found['path']}")
+                            input("Press Enter to continue...")
                     else:
-                        print("Invalid topic number.")
+                        print("Invalid number.")
                         input("Press Enter to continue...")
                 except ValueError:
                     print("Invalid input. Please enter a number.")
                     input("Press Enter to continue...")
 
 
-
-
-csv_file = 'address.csv'  # Path to your CSV file
-try:
-    target_dir_name = get_directory_name_from_csv(csv_file)
-    root_directory = find_root_directory(os.getcwd(), target_dir_name)
-    menu(root_directory)
-except FileNotFoundError as e:
-    print(e)
-except ValueError as e:
-    print(e)
-
-
-
-
-
-
+if __name__ == "__main__":
+    try:
+        menu(resolve_library_root())
+    except FileNotFoundError as e:
+        print(e)
+    except ValueError as e:
+        print(e)
@@ -0,0 +1,107 @@
+import mmap
+import os
+import struct
+from array import array
+
+'''
+----------------------------
+Memory-mapped catalog snapshot
+-----------------------------
+
+The arrays of a compact catalog (see compactcatalog.py) written back to back
+into one binary file:
+
+    header        magic, format version, byte order marker, node count,
+                  name count, name buffer length, root path length and the
+                  catalog signature the snapshot was taken at
+    root path     UTF-8, padded to 8 bytes
+    parents       node count int32
+    name_ids      node count uint32
+    file_counts   node count uint32
+    first_child   node count + 1 uint32
+    name_offsets  name count + 1 uint32
+    names         the name buffer
+
+Reading maps the file and casts memoryviews over it, so opening a snapshot
+costs the same for ten directories or ten million: nothing is parsed or
+copied until a node is actually looked at.  Snapshots are written to a
+temporary file and renamed over the old one, so a reader sees either the old
+or the new file, never a partial one.
+'''
+
+SNAPSHOT_FILE = 'catalog.snapshot'
+SNAPSHOT_VERSION = 1
+
+MAGIC = b'CFVSNAP\0'
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct('=8sIIIIIIddd')
+
+
+def _padding(length):
+    return -length % 8
+
+
+def write_snapshot(snapshot_file, root_dir, signature, parents, name_ids, file_counts,
+                   first_child, name_offsets, names):
+    """
+    Atomically write the arrays of a compact catalog to snapshot_file.
+
+    Returns:
+        bool: False when the old file could not be replaced (on Windows a
+        file mapped by another process cannot be), in which case it is kept.
+    """
+    root = root_dir.encode('utf-8', 'surrogateescape')
+    temp_file = f"{snapshot_file}.tmp"
+    with open(temp_file, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, SNAPSHOT_VERSION, BYTE_ORDER_MARK, len(parents),
+                               len(name_offsets) - 1, len(names), len(root), *signature))
+        file.write(root + b'\0' * _padding(len(root)))
+        for part in (parents, name_ids, file_counts, first_child, name_offsets):
+            file.write(memoryview(part).cast('B'))
+        file.write(names)
+    try:
+        os.replace(temp_file, snapshot_file)
+    except PermissionError:
+        os.remove(temp_file)
+        return False
+    return True
+
+
+def read_snapshot(snapshot_file):
+    """
+    Map a snapshot file.
+
+    Returns:
+        tuple: (root_dir, signature, parents, name_ids, file_counts,
+        first_child, name_offsets, names) with the arrays as memoryviews
+        over the mapping, or None if the file is missing, from another
+        version or platform, or truncated.
+    """
+    try:
+        with open(snapshot_file, 'rb') as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        magic, version, mark, nodes, name_count, names_length, root_length, *signature = \
+            HEADER.unpack_from(mapping, 0)
+    except struct.error:
+        return None
+    if (magic, version, mark) != (MAGIC, SNAPSHOT_VERSION, BYTE_ORDER_MARK):
+        return None
+    item_size = array('I').itemsize
+    root_start = HEADER.size
+    arrays_start = root_start + root_length + _padding(root_length)
+    counts = (('i', nodes), ('I', nodes), ('I', nodes), ('I', nodes + 1), ('I', name_count + 1))
+    size = arrays_start + sum(count for _, count in counts) * item_size + names_length
+    if len(mapping) != size:
+        return None
+
+    view = memoryview(mapping)
+    root_dir = str(view[root_start:root_start + root_length], 'utf-8', 'surrogateescape')
+    parts = []
+    offset = arrays_start
+    for code, count in counts:
+        parts.append(view[offset:offset + count * item_size].cast(code))
+        offset += count * item_size
+    return (root_dir, tuple(signature), *parts, view[offset:offset + names_length])
@@ -0,0 +1,351 @@
+import bisect
+import os
+
+from catalog import get_catalog, parse_tags
+from scanner import rescan
+from tagquery import parse_query
+
+'''
+----------------------------
+Inverted tag index
+-----------------------------
+
+Maps every tag to the set of (publisher, topic) pairs carrying it.  The index
+is built once from the catalog and then kept current by update_dirs whenever
+tag files are saved, so tag listings and tag filters are plain set operations.
+Changes made outside the viewer are picked up by get_tag_index, which
+rescans the root and re-reads only the directories the catalog stored
+anew since the index last looked (Catalog.changed_since).
+
+Tags are inherited downwards: the 'tag.txt' of the library root applies to
+every publisher, a publisher's to all of its topics and a topic's to all of
+its chapters.  effective_tags gives the tags of any directory including the
+inherited ones and caches them per directory; saving a tag file only drops
+the cached entries of the directories below it.  A topic carries its
+effective tags plus those of every directory inside it, so tagging a single
+chapter still makes its topic show up in the filters.
+'''
+
+# Directories TagIndex.catch_up re-reads one by one before it rebuilds instead.
+CATCH_UP_LIMIT = 200
+
+
+class TagIndex:
+    """In-memory tag -> {(publisher, topic)} index for one library root."""
+
+    def __init__(self, root_dir):
+        self.root_dir = os.path.abspath(root_dir)
+        self.tags_by_dir = {}       # directory path -> list of tags in its tag.txt
+        self.dirs_by_topic = {}     # (publisher, topic) -> set of tagged directory paths inside it
+        self.tags_by_topic = {}     # (publisher, topic) -> frozenset of its tags, if it has any
+        self.topics_by_tag = {}     # tag -> set of (publisher, topic)
+        self.effective = {}         # directory path -> frozenset of own and inherited tags
+        self.generation = 0         # Catalog.generation the index is current with
+
+    def build(self, catalog=None, rescan_first=True):
+        """
+        Rescan the library and (re)build the index from the catalog.
+
+        Args:
+            rescan_first (bool): False when the caller just rescanned the root
+                (e.g. Library.rescan on the root's own worker).
+        """
+        catalog = catalog or get_catalog()
+        if rescan_first:
+            rescan(self.root_dir, catalog)
+        self.generation = catalog.generation
+        for table in (self.tags_by_dir, self.dirs_by_topic, self.tags_by_topic,
+                      self.topics_by_tag, self.effective):
+            table.clear()
+        topics = set()
+        for path, tags in catalog.tagged_dirs(self.root_dir):
+            self.tags_by_dir[path] = tags
+            topic = self._topic_of(path)
+            if topic is not None:
+                self.dirs_by_topic.setdefault(topic, set()).add(path)
+            else:
+                topics.update(self._topics_under(path, catalog))
+        self._retag_topics(topics | set(self.dirs_by_topic), catalog)
+        return self
+
+    def _parts(self, path):
+        """Get the components of path below the root, or None if it is outside the root."""
+        relative = os.path.relpath(path, self.root_dir)
+        if relative.startswith(os.pardir):
+            return None
+        return [] if relative == os.curdir else relative.split(os.sep)
+
+    def _topic_of(self, path):
+        """Get the (publisher, topic) a directory belongs to, or None above topic level."""
+        parts = self._parts(path)
+        if parts is None or len(parts) < 2:
+            return None
+        return parts[0], parts[1]
+
+    def _topics_under(self, path, catalog):
+        """Get the topics whose tags depend on the 'tag.txt' of path."""
+        parts = self._parts(path)
+        if parts is None:
+            return set()
+        if len(parts) >= 2:
+            return {(parts[0], parts[1])}
+        publishers = parts or catalog.children(self.root_dir)
+        return {(publisher, topic) for publisher in publishers
+                for topic in catalog.children(os.path.join(self.root_dir, publisher))}
+
+    def effective_tags(self, directory):
+        """Get the tags of a directory's own 'tag.txt' and those inherited from its ancestors."""
+        path = os.path.abspath(directory)
+        tags = self.effective.get(path)
+        if tags is None:
+            tags = set(self.tags_by_dir.get(path, ()))
+            parts = self._parts(path)
+            if parts:
+                tags.update(self.effective_tags(os.path.dirname(path)))
+            tags = self.effective[path] = frozenset(tags)
+        return tags
+
+    def _invalidate(self, path):
+        """Drop the cached effective tags of path and every directory below it."""
+        prefix = os.path.join(path, '')
+        for cached in [cached for cached in self.effective
+                       if cached == path or cached.startswith(prefix)]:
+            del self.effective[cached]
+
+    def _topic_tags(self, topic):
+        tags = set(self.effective_tags(os.path.join(self.root_dir, *topic)))
+        for path in self.dirs_by_topic.get(topic, ()):
+            tags.update(self.tags_by_dir[path])
+        return tags
+
+    def _retag_topics(self, topics, catalog):
+        """Recompute the tags of some topics and patch topics_by_tag with the difference."""
+        listed = {}
+        for topic in topics:
+            publisher, name = topic
+            if publisher not in listed:
+                listed[publisher] = set(catalog.children(os.path.join(self.root_dir, publisher)))
+            exists = topic in self.dirs_by_topic or name in listed[publisher]
+            old_tags = self.tags_by_topic.get(topic, frozenset())
+            new_tags = frozenset(self._topic_tags(topic)) if exists else frozenset()
+            if new_tags:
+                self.tags_by_topic[topic] = new_tags
+            else:
+                self.tags_by_topic.pop(topic, None)
+            for tag in old_tags - new_tags:
+                self.topics_by_tag[tag].discard(topic)
+                if not self.topics_by_tag[tag]:
+                    del self.topics_by_tag[tag]
+            for tag in new_tags - old_tags:
+                self.topics_by_tag.setdefault(tag, set()).add(topic)
+
+    def update_dir(self, directory, catalog=None):
+        """Re-read the tags of one directory from the catalog and patch the index."""
+        self.update_dirs([directory], catalog)
+
+    def update_dirs(self, directories, catalog=None):
+        """
+        Re-read the tags of several directories and patch the index.
+
+        The directories are validated concurrently and their catalog entries
+        are stored in a single transaction.
+        """
+        catalog = catalog or get_catalog()
+        paths = [os.path.abspath(directory) for directory in directories]
+        records = catalog.refresh_many(paths)
+        topics = set()
+        for path, record in zip(paths, records):
+            self._set_dir_tags(path, parse_tags(record.tags or '')
+                               if record.tag_mtime is not None else None)
+            topics.update(self._topics_under(path, catalog))
+        self._retag_topics(topics, catalog)
+
+    def _set_dir_tags(self, path, tags):
+        """Record the tags of one directory (None when it has no tag file)."""
+        topic = self._topic_of(path)
+        if tags is not None:
+            self.tags_by_dir[path] = tags
+            if topic is not None:
+                self.dirs_by_topic.setdefault(topic, set()).add(path)
+        else:
+            self.tags_by_dir.pop(path, None)
+            if topic in self.dirs_by_topic:
+                self.dirs_by_topic[topic].discard(path)
+                if not self.dirs_by_topic[topic]:
+                    del self.dirs_by_topic[topic]
+        self._invalidate(path)
+
+    def refresh_subtree(self, directory, catalog=None):
+        """Re-read every tagged directory at or below directory from the catalog."""
+        catalog = catalog or get_catalog()
+        path = os.path.abspath(directory)
+        prefix = os.path.join(path, '')
+        stale = [tagged for tagged in self.tags_by_dir
+                 if tagged == path or tagged.startswith(prefix)]
+        fresh = catalog.tagged_dirs(path)
+        topics = self._topics_under(path, catalog)
+        topics.update(topic for topic in self.tags_by_topic
+                      if os.path.join(self.root_dir, *topic).startswith(prefix))
+        for tagged in stale:
+            topics.update(self._topics_under(tagged, catalog))
+            self._set_dir_tags(tagged, None)
+        for tagged, tags in fresh:
+            topics.update(self._topics_under(tagged, catalog))
+            self._set_dir_tags(tagged, tags)
+        self._invalidate(path)
+        self._retag_topics(topics, catalog)
+
+    def catch_up(self, catalog=None):
+        """Re-read the directories below the root that the catalog stored anew since the index last looked."""
+        catalog = catalog or get_catalog()
+        paths, self.generation = catalog.changed_since(self.generation)
+        if paths is not None:
+            prefix = os.path.join(self.root_dir, '')
+            paths = _outermost(path for path in paths
+                               if path == self.root_dir or path.startswith(prefix))
+        if paths is None or len(paths) > CATCH_UP_LIMIT:
+            return self.build(catalog, rescan_first=False)
+        for path in paths:
+            self.refresh_subtree(path, catalog)
+        return self
+
+    def all_tags(self):
+        """Get every tag used anywhere in the library, sorted."""
+        tags = set()
+        for dir_tags in self.tags_by_dir.values():
+            tags.update(dir_tags)
+        return sorted(tags)
+
+    def topics(self, tag):
+        """Get the set of (publisher, topic) pairs carrying a tag."""
+        return self.topics_by_tag.get(tag, set())
+
+    def query(self, all_of=(), any_of=(), none_of=()):
+        """
+        Find topics by a combination of tags.
+
+        Args:
+            all_of (iterable): Tags a topic must all carry (AND).
+            any_of (iterable): Tags of which a topic must carry at least one (OR).
+            none_of (iterable): Tags a topic must not carry (NOT).
+
+        Returns:
+            list: Sorted (publisher, topic) pairs. Topics without any tag
+            are never returned.
+        """
+        result = None
+        for tag in all_of:
+            result = set(self.topics(tag)) if result is None else result & self.topics(tag)
+        if any_of:
+            matched = set().union(*(self.topics(tag) for tag in any_of))
+            result = matched if result is None else result & matched
+        if result is None:
+            result = set(self.tags_by_topic)
+        for tag in none_of:
+            result = result - self.topics(tag)
+        return sorted(result)
+
+
+    def counts(self, publishers=None):
+        """
+        Get the number of topics carrying each tag.
+
+        Args:
+            publishers (set): Only count topics of these publishers, all by default.
+
+        Returns:
+            dict: tag -> number of topics.
+        """
+        if publishers is None:
+            return {tag: len(topics) for tag, topics in self.topics_by_tag.items()}
+        return {tag: sum(1 for publisher, _ in topics if publisher in publishers)
+                for tag, topics in self.topics_by_tag.items()}
+
+    def _prefixed(self, prefix):
+        tags = sorted(self.topics_by_tag)
+        start = bisect.bisect_left(tags, prefix)
+        matched = set()
+        for tag in tags[start:]:
+            if not tag.startswith(prefix):
+                break
+            matched |= self.topics_by_tag[tag]
+        return matched
+
+    def _evaluate(self, node):
+        kind, value = node
+        if kind == 'tag':
+            return set(self.topics(value))
+        if kind == 'prefix':
+            return self._prefixed(value)
+        if kind == 'not':
+            return set(self.tags_by_topic) - self._evaluate(value)
+        results = [self._evaluate(child) for child in value]
+        if kind == 'and':
+            return set.intersection(*results)
+        return set.union(*results)
+
+    def search(self, expression):
+        """
+        Find topics matching a tag query such as "exam, 2024, -draft" (see tagquery.py).
+
+        Returns:
+            list: Sorted (publisher, topic) pairs. Topics without any tag
+            are never returned.
+
+        Raises:
+            ValueError: If the query is malformed.
+        """
+        return sorted(self._evaluate(parse_query(expression)))
+
+def _outermost(paths):
+    """Get the sorted paths that are not inside another one of them."""
+    outermost = []
+    for path in sorted(set(paths)):
+        if not outermost or not path.startswith(os.path.join(outermost[-1], '')):
+            outermost.append(path)
+    return outermost
+
+
+_indexes = {}
+
+
+def get_tag_index(root_dir, rescan_first=True):
+    """
+    Get the tag index of a library root, building it on first use (see TagIndex.build).
+
+    Later calls rescan the root, which costs a stat per directory when
+    nothing changed, and patch the index with what changed (see TagIndex.catch_up).
+
+    Args:
+        rescan_first (bool): False when the caller just rescanned the root.
+    """
+    root_dir = os.path.abspath(root_dir)
+    index = _indexes.get(root_dir)
+    if index is None:
+        index = _indexes[root_dir] = TagIndex(root_dir).build(rescan_first=rescan_first)
+    else:
+        if rescan_first:
+            rescan(root_dir)
+        index.catch_up()
+    return index
+
+
+def clear_tag_indexes():
+    """Forget every built tag index; the next get_tag_index rebuilds it."""
+    _indexes.clear()
+
+
+def loaded_tag_index(root_dir):
+    """Get the tag index of a library root if it was already built, else None."""
+    return _indexes.get(os.path.abspath(root_dir))
+
+
+def tags_saved(*directories):
+    """Patch every loaded tag index after the 'tag.txt' of the directories were written."""
+    directories = [os.path.abspath(directory) for directory in directories]
+    for root_dir, index in _indexes.items():
+        prefix = os.path.join(root_dir, '')
+        inside = [directory for directory in directories
+                  if directory == root_dir or directory.startswith(prefix)]
+        if inside:
+            index.update_dirs(inside)
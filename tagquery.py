@@ -0,0 +1,115 @@
+import re
+
+'''
+----------------------------
+Tag query language
+-----------------------------
+
+    exam, 2024, -draft          topics tagged exam and 2024 but not draft
+    exam | review               topics tagged exam or review
+    (2023 OR 2024) AND NOT draft
+    sol*                        topics with any tag starting with 'sol'
+
+Commas separate conditions that must all hold, so they bind loosest.  Inside
+a condition '|' (or OR) binds looser than '&' (or AND), and '-', '!' or NOT
+negate what follows.  Words not separated by an operator form one tag, so
+multi-word tags need no quoting.  Keywords are only recognised in upper case.
+
+parse_query turns the text into a small tree of tuples:
+
+    ('tag', name)   ('prefix', start)   ('not', node)
+    ('and', [nodes])   ('or', [nodes])
+
+which TagIndex.search evaluates with set operations.
+'''
+
+TOKEN = re.compile(r'\s*(?:([,|&()!])|([^\s,|&()!]+))')
+KEYWORDS = {'AND': '&', 'OR': '|', 'NOT': '!'}
+
+
+def _tokenize(text):
+    """Get the operator and tag tokens of a query as ('op', char) / ('tag', text) pairs."""
+    tokens = []
+    words = []
+
+    def flush():
+        if words:
+            tokens.append(('tag', ' '.join(words)))
+            words.clear()
+
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        found = TOKEN.match(text, position)
+        position = found.end()
+        operator, word = found.groups()
+        if word in KEYWORDS:
+            operator, word = KEYWORDS[word], None
+        if operator is not None:
+            flush()
+            tokens.append(('op', operator))
+        elif word.startswith('-') and not words:
+            tokens.append(('op', '!'))
+            if word[1:]:
+                words.append(word[1:])
+        else:
+            words.append(word)
+    flush()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, text):
+        self.tokens = _tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def accept(self, operator):
+        if self.peek() == ('op', operator):
+            self.position += 1
+            return True
+        return False
+
+    def expression(self, separator):
+        """Parse operands joined by separator, each parsed by the next tighter level."""
+        tighter = {',': '|', '|': '&'}.get(separator)
+        kind = 'and' if separator in (',', '&') else 'or'
+        nodes = [self.expression(tighter) if tighter else self.unary()]
+        while self.accept(separator):
+            nodes.append(self.expression(tighter) if tighter else self.unary())
+        return nodes[0] if len(nodes) == 1 else (kind, nodes)
+
+    def unary(self):
+        if self.accept('!'):
+            return ('not', self.unary())
+        if self.accept('('):
+            node = self.expression(',')
+            if not self.accept(')'):
+                raise ValueError("Missing ')' in tag query.")
+            return node
+        kind, value = self.peek()
+        if kind != 'tag':
+            raise ValueError(f"Expected a tag but found '{value or 'end of query'}'.")
+        self.position += 1
+        if value.endswith('*'):
+            return ('prefix', value[:-1])
+        return ('tag', value)
+
+
+def parse_query(text):
+    """
+    Parse a tag query.
+
+    Raises:
+        ValueError: If the query is empty or malformed.
+    """
+    parser = _Parser(text)
+    if not parser.tokens:
+        raise ValueError("The tag query is empty.")
+    tree = parser.expression(',')
+    kind, value = parser.peek()
+    if kind is not None:
+        raise ValueError(f"Unexpected '{value}' in tag query.")
+    return tree
@@ -0,0 +1,97 @@
+import contextlib
+import os
+import sys
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import select
+    import termios
+    import tty
+
+'''
+----------------------------
+Key by key terminal input
+-----------------------------
+
+For screens that react to every key press instead of a whole line, such as
+search-as-you-type.  On POSIX terminals raw_mode puts the terminal in cbreak
+mode (no line buffering or echo, Ctrl+C still works) and restores it
+afterwards; on Windows msvcrt reads single keys without any mode change.
+
+read_key returns the typed character, or one of 'enter', 'backspace' and
+'escape'.  Other special keys (arrows, function keys) return None.
+'''
+
+ENTER, BACKSPACE, ESCAPE = 'enter', 'backspace', 'escape'
+
+
+def is_interactive():
+    """Tell whether stdin and stdout are a terminal that can be read key by key."""
+    return sys.stdin.isatty() and sys.stdout.isatty()
+
+
+@contextlib.contextmanager
+def raw_mode():
+    """Read keys without waiting for Enter while inside the block."""
+    if os.name == 'nt':
+        yield
+        return
+    fd = sys.stdin.fileno()
+    saved = termios.tcgetattr(fd)
+    try:
+        tty.setcbreak(fd)
+        yield
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, saved)
+
+
+def _read_posix():
+    fd = sys.stdin.fileno()
+    data = os.read(fd, 1)
+    if data == b'\x1b':
+        # A lone Escape, or the start of an arrow or function key sequence.
+        if not select.select([fd], [], [], 0.02)[0]:
+            return ESCAPE
+        while select.select([fd], [], [], 0.02)[0]:
+            os.read(fd, 16)
+        return None
+    # Complete a multi-byte UTF-8 character.
+    if data and data[0] >= 0xC0:
+        length = 2 if data[0] < 0xE0 else 3 if data[0] < 0xF0 else 4
+        data += os.read(fd, length - 1)
+    if data in (b'\r', b'\n'):
+        return ENTER
+    if data in (b'\x7f', b'\x08'):
+        return BACKSPACE
+    text = data.decode('utf-8', 'replace')
+    return text if text.isprintable() else None
+
+
+def _read_windows():
+    char = msvcrt.getwch()
+    if char in ('\x00', '\xe0'):
+        msvcrt.getwch()     # Second half of an arrow or function key.
+        return None
+    if char == '\x03':
+        raise KeyboardInterrupt
+    if char == '\r':
+        return ENTER
+    if char == '\x08':
+        return BACKSPACE
+    if char == '\x1b':
+        return ESCAPE
+    return char if char.isprintable() else None
+
+
+def read_key():
+    """Wait for one key press (call inside raw_mode on POSIX)."""
+    return _read_windows() if os.name == 'nt' else _read_posix()
+
+
+def redraw():
+    """Clear the screen quickly enough to redraw it on every key press."""
+    if os.name == 'nt':
+        os.system('cls')
+    else:
+        sys.stdout.write('\033[H\033[J')
@@ -0,0 +1,149 @@
+import os
+import pickle
+from array import array
+
+from catalog import PUBLISHER_PREFIXES, get_catalog, get_publishers
+from profiling import trace
+
+'''
+----------------------------
+Trigram index of topic names
+-----------------------------
+
+Every lower-cased topic name is split into its three-character substrings
+(trigrams) and each trigram keeps the ids of the topics containing it.  A
+substring query of three or more characters only has to look at the topics
+present in the posting lists of all of its trigrams.
+
+The index is derived from the catalog and pickled next to it.  It is keyed
+on the mtimes of the publisher directories, so it is only rebuilt when a
+topic was added, removed or renamed.
+'''
+
+TOPIC_INDEX_FILE = 'topic_index.pickle'
+TOPIC_INDEX_VERSION = 1
+
+
+def trigrams(text):
+    """Get the set of three-character substrings of text."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TopicIndex:
+    """Trigram posting lists over the topic names of a set of publishers."""
+
+    def __init__(self, topics, fingerprint=None):
+        """
+        Args:
+            topics (list): (publisher, topic) pairs to index.
+            fingerprint (tuple): Publisher mtimes the topics were read at.
+        """
+        self.topics = sorted(topics)
+        self.fingerprint = fingerprint
+        self.names = [topic.lower() for _, topic in self.topics]
+        postings = {}
+        for topic_id, name in enumerate(self.names):
+            for gram in trigrams(name):
+                postings.setdefault(gram, array('I')).append(topic_id)
+        self.postings = postings
+
+    def candidates(self, query):
+        """Get the ids of topics containing every trigram of a lower-cased query."""
+        lists = [self.postings.get(gram) for gram in trigrams(query)]
+        if not lists or any(ids is None for ids in lists):
+            return []
+        lists.sort(key=len)
+        result = set(lists[0])
+        for ids in lists[1:]:
+            result.intersection_update(ids)
+            if not result:
+                break
+        return sorted(result)
+
+    @trace('search')
+    def search(self, query):
+        """
+        Find topics whose name contains query, case-insensitively.
+
+        Args:
+            query (str): Substring to look for, at least 3 characters.
+
+        Returns:
+            list: Sorted (publisher, topic) pairs.
+        """
+        query = query.lower()
+        if len(query) < 3:
+            return []
+        return [self.topics[topic_id] for topic_id in self.candidates(query)
+                if query in self.names[topic_id]]
+
+
+def _fingerprint(root_dir, publishers, records):
+    return (root_dir, tuple((publisher, records[publisher].mtime, records[publisher].inode)
+                            for publisher in publishers))
+
+
+def _load(index_file):
+    try:
+        with open(index_file, 'rb') as file:
+            version, index = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError):
+        return None
+    return index if version == TOPIC_INDEX_VERSION else None
+
+
+def _save(index_file, index):
+    temp_file = f"{index_file}.tmp"
+    with open(temp_file, 'wb') as file:
+        pickle.dump((TOPIC_INDEX_VERSION, index), file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_file, index_file)
+
+
+_indexes = {}
+
+
+def _current_index(root_dir, prefixes, index_file, publishers, fingerprint, catalog):
+    """Reuse the index from memory or index_file if it matches fingerprint, else rebuild it."""
+    key = (root_dir, tuple(prefixes))
+    index = _indexes.get(key)
+    if index is None or index.fingerprint != fingerprint:
+        index = _load(index_file)
+        if index is None or index.fingerprint != fingerprint:
+            topics = [(publisher, topic) for publisher in publishers
+                      for topic in catalog.children(os.path.join(root_dir, publisher))]
+            index = TopicIndex(topics, fingerprint)
+            _save(index_file, index)
+        _indexes[key] = index
+    return index
+
+
+def get_topic_index(root_dir, prefixes=PUBLISHER_PREFIXES, index_file=TOPIC_INDEX_FILE, refresh=True):
+    """
+    Get an up-to-date topic index for the publishers of root_dir.
+
+    Costs one stat per publisher when nothing changed.  The index is reused
+    from memory, then from index_file, and only rebuilt from the catalog when
+    the publisher mtimes differ from the ones it was built at.
+
+    Args:
+        refresh (bool): Stat the root and its publishers; False when the
+            caller just did (e.g. Library.rescan(depth=1) on the root's own
+            worker), so only the catalog is read.
+    """
+    root_dir = os.path.abspath(root_dir)
+    catalog = get_catalog()
+    if refresh:
+        publishers = get_publishers(root_dir, prefixes)
+        paths = [os.path.join(root_dir, publisher) for publisher in publishers]
+        records = dict(zip(publishers, catalog.refresh_many(paths)))
+    else:
+        publishers = [name for name in catalog.children(root_dir) if name.startswith(tuple(prefixes))]
+        records = {publisher: catalog.record(os.path.join(root_dir, publisher))
+                   for publisher in publishers}
+    fingerprint = _fingerprint(root_dir, publishers, records)
+    return _current_index(root_dir, prefixes, index_file, publishers, fingerprint, catalog)
+
+
+def clear_topic_indexes():
+    """Forget the topic indexes held in memory (the file on disk is kept)."""
+    _indexes.clear()
@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import sys
+
+from bulktags import publisher_topic_dirs, retag
+from catalog import count_files_many, get_chapters, get_topics
+from library import get_library, print_unavailable, resolve_library_root
+from menuName import find_matches
+from menuNum import filter_topics_by_query, filter_topics_by_tags, tag_counts, tag_indexes
+from ranksearch import RANKED_LIMIT, SearchSession
+from search import ranked_indexes, search_topics
+
+'''
+----------------------------
+Non-interactive command line
+-----------------------------
+
+Exposes the lookups behind the menus as batch commands for scripts and
+benchmarks, e.g.
+
+    python viewer.py list publishers
+    python viewer.py list chapters __Publisher "Some Topic" --json
+    python viewer.py search physics --json
+    python viewer.py find ch --limit 20
+    python viewer.py tags --tag exam --tag 2024 --not-tag draft --json
+    python viewer.py tags --query "exam, 2024, -draft"
+    python viewer.py retag --publisher __Publisher --add 2024 --remove draft
+    python viewer.py match topics __Publisher phisics
+    python viewer.py search --stdin --json < queries.txt
+
+With --json every result is printed as one JSON object per line.
+'''
+
+
+def emit(records, as_json, text_key):
+    """Print result records as JSON lines or as plain text (the text_key field only)."""
+    write = sys.stdout.write
+    for record in records:
+        write(json.dumps(record, ensure_ascii=False) if as_json else str(record[text_key]))
+        write('\n')
+
+
+def require_available(library, path):
+    """Get path back, or exit if it is on a root that did not respond."""
+    if not library.is_available(path):
+        sys.exit(f"'{library.root_of(path)}' did not respond; try again once it is back.")
+    return path
+
+
+def read_queries(args):
+    """Get the queries of a command: the positional one, or one per stdin line with --stdin."""
+    if args.stdin:
+        return (line.strip() for line in sys.stdin if line.strip())
+    if not args.query:
+        sys.exit("A query is required unless --stdin is given.")
+    return [args.query]
+
+
+def cmd_list(args, root_dir):
+    library = get_library(root_dir)
+    if args.level == 'publishers':
+        emit(({'publisher': publisher.name, 'path': publisher.path}
+              for publisher in library.publishers()), args.json, 'publisher')
+        print_unavailable(library, sys.stderr)
+        return
+    if not args.publisher:
+        sys.exit(f"'list {args.level}' needs a publisher.")
+    library.publishers()
+    publisher_path = require_available(library, library.publisher_path(args.publisher))
+    if args.level == 'topics':
+        emit(({'publisher': args.publisher, 'topic': topic} for topic in get_topics(publisher_path)),
+             args.json, 'topic')
+        return
+    if not args.topic:
+        sys.exit("'list chapters' needs a publisher and a topic.")
+    topic_path = os.path.join(publisher_path, args.topic)
+    chapters = get_chapters(topic_path)
+    file_counts = count_files_many([os.path.join(topic_path, chapter) for chapter in chapters])
+    emit(({'publisher': args.publisher, 'topic': args.topic, 'chapter': chapter, 'files': files}
+          for chapter, files in zip(chapters, file_counts)), args.json, 'chapter')
+
+
+def cmd_search(args, root_dir):
+    for query in read_queries(args):
+        emit(({'query': query, 'publisher': os.path.basename(publisher_path), 'topic': topic,
+               'path': os.path.join(publisher_path, topic)}
+              for topic, publisher_path in search_topics(root_dir, query)), args.json, 'topic')
+
+
+def cmd_find(args, root_dir):
+    # Rescan and build the indexes once; every query (e.g. each --stdin line)
+    # is then answered from them.
+    session = SearchSession(lambda: ranked_indexes(root_dir), limit=args.limit)
+    for query in read_queries(args):
+        emit(({'query': query, **found} for found in session.search(query)), args.json, 'path')
+
+
+def cmd_tags(args, root_dir):
+    library = get_library(root_dir)
+    if not (args.tag or args.all_tag or args.not_tag or args.query):
+        all_tags, counts = tag_counts(root_dir)
+        emit(({'tag': tag, 'topics': counts.get(tag, 0)} for tag in all_tags), args.json, 'tag')
+        return
+    library.publishers()
+    if args.query:
+        try:
+            topics = filter_topics_by_query(root_dir, args.query)
+        except ValueError as e:
+            sys.exit(str(e))
+    elif args.tag and not (args.all_tag or args.not_tag):
+        topics = filter_topics_by_tags(root_dir, args.tag)
+    else:
+        indexes = tag_indexes(root_dir)
+        topics = library.collect(lambda root: indexes[root].query(
+            all_of=args.all_tag, any_of=args.tag, none_of=args.not_tag), indexes)
+    emit(({'publisher': publisher, 'topic': topic} for publisher, topic in topics),
+         args.json, 'topic')
+
+
+def cmd_retag(args, root_dir):
+    if not (args.add or args.remove):
+        sys.exit("Give at least one --add or --remove tag.")
+    library = get_library(root_dir)
+    library.publishers()
+    if args.query:
+        try:
+            topics = filter_topics_by_query(root_dir, args.query)
+        except ValueError as e:
+            sys.exit(str(e))
+        directories = [os.path.join(library.publisher_path(publisher), topic)
+                       for publisher, topic in topics]
+    elif args.publisher and args.topic:
+        publisher_path = require_available(library, library.publisher_path(args.publisher))
+        directories = [os.path.join(publisher_path, topic) for topic in args.topic]
+    elif args.publisher:
+        directories = publisher_topic_dirs(require_available(library, library.publisher_path(args.publisher)))
+    else:
+        sys.exit("Give --publisher (with optional --topic) or --query to select topics.")
+    changed, failed = retag(directories, args.add, args.remove)
+    changed, errors = set(changed), dict(failed)
+    records = []
+    for directory in directories:
+        path = os.path.abspath(directory)
+        record = {'directory': directory, 'changed': path in changed}
+        if path in errors:
+            record['error'] = str(errors[path])
+        records.append(record)
+    emit(records, args.json, 'directory')
+    for directory, error in failed:
+        print(f"Could not retag {directory}: {error}", file=sys.stderr)
+
+
+def cmd_match(args, root_dir):
+    library = get_library(root_dir)
+    publishers = library.publishers()
+    if args.level == 'publishers':
+        choices = [publisher.name for publisher in publishers]
+    else:
+        publisher_path = require_available(library, library.publisher_path(args.publisher))
+        if args.level == 'topics':
+            choices = get_topics(publisher_path)
+        else:
+            choices = get_chapters(os.path.join(publisher_path, args.topic))
+    for query in read_queries(args):
+        emit(({'query': query, 'rank': rank, 'match': match}
+              for rank, match in enumerate(find_matches(query, choices), 1)), args.json, 'match')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Query the myBooks library without the menus.")
+    parser.add_argument('--json', action='store_true', help="print results as JSON lines")
+    parser.add_argument('--root', action='append', metavar='DIR',
+                        help="library root to use instead of those in address.csv (repeatable)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = commands.add_parser('list', help="list publishers, topics or chapters")
+    list_parser.add_argument('level', choices=['publishers', 'topics', 'chapters'])
+    list_parser.add_argument('publisher', nargs='?')
+    list_parser.add_argument('topic', nargs='?')
+    list_parser.set_defaults(handler=cmd_list)
+
+    search_parser = commands.add_parser('search', help="search topic names across publishers")
+    search_parser.add_argument('query', nargs='?')
+    search_parser.add_argument('--stdin', action='store_true', help="read one query per line")
+    search_parser.set_defaults(handler=cmd_search)
+
+    find_parser = commands.add_parser('find', help="ranked search of publishers, topics and chapters")
+    find_parser.add_argument('query', nargs='?')
+    find_parser.add_argument('--limit', type=int, default=RANKED_LIMIT, help="maximum number of results")
+    find_parser.add_argument('--stdin', action='store_true', help="read one query per line")
+    find_parser.set_defaults(handler=cmd_find)
+
+    tags_parser = commands.add_parser('tags', help="list tags, or topics carrying tags")
+    tags_parser.add_argument('--tag', action='append', default=[],
+                             help="topics with any of these tags (repeatable)")
+    tags_parser.add_argument('--all-tag', action='append', default=[],
+                             help="topics with all of these tags (repeatable)")
+    tags_parser.add_argument('--not-tag', action='append', default=[],
+                             help="topics without these tags (repeatable)")
+    tags_parser.add_argument('--query',
+                             help="tag query such as 'exam, 2024, -draft' (overrides the tag options)")
+    tags_parser.set_defaults(handler=cmd_tags)
+
+    retag_parser = commands.add_parser('retag', help="add or remove tags on many topics at once")
+    retag_parser.add_argument('--add', action='append', default=[], help="tag to add (repeatable)")
+    retag_parser.add_argument('--remove', action='append', default=[],
+                              help="tag to remove (repeatable)")
+    retag_parser.add_argument('--publisher', help="retag the topics of this publisher")
+    retag_parser.add_argument('--topic', action='append', default=[],
+                              help="only these topics of --publisher (repeatable)")
+    retag_parser.add_argument('--query', help="retag the topics matching this tag query")
+    retag_parser.set_defaults(handler=cmd_retag)
+
+    match_parser = commands.add_parser('match', help="fuzzy match a name like the 'by name' menu")
+    match_parser.add_argument('level', choices=['publishers', 'topics', 'chapters'])
+    match_parser.add_argument('path', nargs='*', help="publisher (and topic) to match within")
+    match_parser.add_argument('--stdin', action='store_true', help="read one query per line")
+    match_parser.set_defaults(handler=cmd_match)
+
+    for command in (list_parser, search_parser, find_parser, tags_parser, retag_parser, match_parser):
+        command.add_argument('--json', action='store_true', default=argparse.SUPPRESS,
+                             help="print results as JSON lines")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'match':
+        needed = {'publishers': 0, 'topics': 1, 'chapters': 2}[args.level]
+        if len(args.path) not in (needed, needed + 1) or (args.stdin and len(args.path) != needed):
+            sys.exit(f"'match {args.level}' takes {needed} path argument(s) and a query.")
+        args.publisher, args.topic = (args.path[:needed] + [None, None])[:2]
+        args.query = args.path[needed] if len(args.path) > needed else None
+    try:
+        root_dir = resolve_library_root(roots=args.root)
+    except (FileNotFoundError, ValueError) as e:
+        sys.exit(str(e))
+    args.handler(args, root_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+
+from catalog import TAG_FILE, add_sync_hook, get_catalog, remove_sync_hook
+from scanner import rescan
+from tagindex import loaded_tag_index
+
+'''
+----------------------------
+Live updates of the catalog
+-----------------------------
+
+A background thread watches the library and queues the directories that
+changed.  The queue is drained on the main thread each time the catalog is
+fetched (see catalog.add_sync_hook), so SQLite is only ever used from the
+thread that owns the connection.  Draining re-lists just those directories
+and patches the tag index; new directories are scanned and watched too.
+
+On Linux the kernel's inotify is used through ctypes.  Everywhere else, or
+when inotify is unavailable or out of watches, the directories and their
+tag files are polled by mtime instead: the publishers and topics every
+POLL_INTERVAL, the chapters and anything deeper a slice at a time, so a
+large library costs a bounded number of stats per second and its deep
+changes just take longer to show up.
+'''
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ATTRIB | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+POLL_INTERVAL = 2.0
+# Directories below topic level the polling watcher checks per second, in turns.
+DEEP_POLL_RATE = int(os.environ.get('VIEWER_DEEP_POLL_RATE', 250))
+
+
+class WatcherUnavailable(OSError):
+    """Raised when the native watcher cannot be used and polling should take over."""
+
+
+class BaseWatcher:
+    """Queue of changed directories shared by the inotify and polling watchers."""
+
+    def __init__(self, root_dir):
+        self.root_dir = os.path.abspath(root_dir)
+        self.changed = queue.Queue()
+        self.stopped = threading.Event()
+        self.thread = None
+        self._applying = False
+
+    def start(self, catalog=None):
+        """Scan the library, watch every listed directory and start the background thread."""
+        catalog = catalog or get_catalog()
+        rescan(self.root_dir, catalog)
+        self.watch(catalog.listed_dirs(self.root_dir))
+        self.thread = threading.Thread(target=self.run, name=type(self).__name__, daemon=True)
+        self.thread.start()
+        add_sync_hook(self.apply)
+        return self
+
+    def stop(self):
+        """Stop the background thread and stop applying events."""
+        remove_sync_hook(self.apply)
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def watch(self, paths):
+        """Start watching the given directories."""
+        raise NotImplementedError
+
+    def run(self):
+        """Body of the background thread: put changed directories on self.changed."""
+        raise NotImplementedError
+
+    def apply(self, catalog):
+        """Apply the queued changes to the catalog and the tag index (main thread only)."""
+        if self._applying:
+            return
+        self._applying = True
+        try:
+            dirty = set()
+            while True:
+                try:
+                    dirty.add(self.changed.get_nowait())
+                except queue.Empty:
+                    break
+            if None in dirty:
+                # The event queue overflowed: fall back to one incremental rescan.
+                self._apply_rescan(catalog)
+                return
+            for path in sorted(dirty):
+                self._apply_dir(catalog, path)
+        finally:
+            self._applying = False
+
+    def _apply_rescan(self, catalog):
+        changes = rescan(self.root_dir, catalog)
+        self.watch(changes.added + [new for _, new in changes.renamed])
+        self._refresh_tags(catalog, self.root_dir)
+
+    def _apply_dir(self, catalog, path):
+        try:
+            _, changes = catalog.update(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        self._refresh_tags(catalog, path, subtree=False)
+        if changes is None:
+            return
+        for added in changes.added:
+            new = rescan(added, catalog)
+            self.watch([added] + new.added)
+            self._refresh_tags(catalog, added)
+        for old, new in changes.renamed:
+            self.watch(catalog.listed_dirs(new))
+            self._refresh_tags(catalog, old)
+            self._refresh_tags(catalog, new)
+        for removed in changes.removed:
+            self._refresh_tags(catalog, removed)
+
+    def _refresh_tags(self, catalog, path, subtree=True):
+        index = loaded_tag_index(self.root_dir)
+        if index is None:
+            return
+        if subtree:
+            index.refresh_subtree(path, catalog)
+        else:
+            index.update_dir(path, catalog)
+
+
+class InotifyWatcher(BaseWatcher):
+    """Linux watcher using one inotify watch per listed directory."""
+
+    def __init__(self, root_dir):
+        super().__init__(root_dir)
+        if not sys.platform.startswith('linux'):
+            raise WatcherUnavailable("inotify is only available on Linux")
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        try:
+            self.libc = ctypes.CDLL(libc_name, use_errno=True)
+            self.libc.inotify_init1
+        except (OSError, AttributeError) as e:
+            raise WatcherUnavailable(f"inotify is not available: {e}")
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise WatcherUnavailable(os.strerror(ctypes.get_errno()))
+        self.paths_by_wd = {}
+        self.lock = threading.Lock()
+
+    def watch(self, paths):
+        for path in paths:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                if ctypes.get_errno() != errno.ENOSPC:
+                    continue
+                if self.thread is None:
+                    raise WatcherUnavailable("out of inotify watches")
+                print("Warning: out of inotify watches; raise fs.inotify.max_user_watches "
+                      f"to see changes in {path}.")
+                return
+            with self.lock:
+                self.paths_by_wd[wd] = path
+
+    def stop(self):
+        super().stop()
+        os.close(self.fd)
+
+    def run(self):
+        while not self.stopped.is_set():
+            readable, _, _ = select.select([self.fd], [], [], 0.5)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    self.changed.put(None)
+                    continue
+                with self.lock:
+                    path = self.paths_by_wd.get(wd)
+                    if mask & IN_IGNORED:
+                        self.paths_by_wd.pop(wd, None)
+                if path is None or mask & IN_IGNORED:
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    # The parent directory sees the same change.
+                    path = os.path.dirname(path)
+                self.changed.put(path)
+
+
+class PollingWatcher(BaseWatcher):
+    """Portable watcher comparing directory and tag file mtimes every few seconds."""
+
+    def __init__(self, root_dir, interval=POLL_INTERVAL, deep_rate=DEEP_POLL_RATE):
+        super().__init__(root_dir)
+        self.interval = interval
+        self.deep_batch = max(1, int(deep_rate * interval))
+        self.mtimes = {}            # root, publishers and topics: polled every interval
+        self.deep_mtimes = {}       # chapters and below: deep_batch of them per interval
+
+    def _is_deep(self, path):
+        relative = os.path.relpath(path, self.root_dir)
+        return relative != os.curdir and relative.count(os.sep) >= 2
+
+    def _stamp(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        try:
+            return mtime, os.stat(os.path.join(path, TAG_FILE)).st_mtime_ns
+        except OSError:
+            return mtime, None
+
+    def watch(self, paths):
+        # Runs on the main thread; the polling thread only reads a snapshot.
+        mtimes, deep_mtimes = dict(self.mtimes), dict(self.deep_mtimes)
+        for path in paths:
+            (deep_mtimes if self._is_deep(path) else mtimes)[path] = self._stamp(path)
+        self.mtimes, self.deep_mtimes = mtimes, deep_mtimes
+
+    def _poll(self, mtimes, paths):
+        for path in paths:
+            current = self._stamp(path)
+            if current != mtimes[path]:
+                mtimes[path] = current
+                self.changed.put(path)
+
+    def run(self):
+        turn = 0
+        while not self.stopped.wait(self.interval):
+            mtimes = self.mtimes
+            self._poll(mtimes, list(mtimes))
+            deep_mtimes = self.deep_mtimes
+            self._poll(deep_mtimes, list(deep_mtimes)[turn:turn + self.deep_batch])
+            turn += self.deep_batch
+            if turn >= len(deep_mtimes):
+                turn = 0
+
+
+def start_watcher(root_dir, catalog=None):
+    """Start the best available watcher for root_dir: inotify if possible, else polling."""
+    try:
+        watcher = InotifyWatcher(root_dir)
+    except WatcherUnavailable:
+        return PollingWatcher(root_dir).start(catalog)
+    try:
+        return watcher.start(catalog)
+    except WatcherUnavailable:
+        os.close(watcher.fd)
+        return PollingWatcher(root_dir).start(catalog)